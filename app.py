@@ -1,13 +1,25 @@
-from flask import Flask, render_template, jsonify
-from flask_socketio import SocketIO
+import time
+STARTED_AT = time.perf_counter()  # Startup timing includes the imports below
+
+from flask import Flask, render_template, jsonify, request, Response
+from flask_socketio import SocketIO, join_room, leave_room
 import logging
 import os
 import sys
-import torch
 import argparse
 from app_utils.config import config
+from app_utils.engines import load_engine
+from app_utils.metrics import metrics
+from app_utils.timing import PhaseTimer
 from routes.source_routes import source_routes
+from routes._model_routes import model_routes
+from routes.detection_routes import detection_routes
+from app_models.detection import Detection
+from app_models.source import Source
+from controllers._model import ModelRegistry
+from controllers.flow import ClientFlow
 from controllers.stream import StreamController
+IMPORTED_AT = time.perf_counter()
 
 # Configure logging
 logging.basicConfig(
@@ -19,21 +31,17 @@ logging.basicConfig(
     ]
 )
 
-def load_model(model_path):
+def load_model(dataset_path):
     try:
-        logging.info(f"Loading model from {model_path}")
-        model = torch.hub.load('ultralytics/yolov5', 
-                             'custom', 
-                             path=model_path, 
-                             force_reload=True,
-                             trust_repo=True)
-        
-        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        model = model.to(device)
-        model.eval()
+        engine_name = config['yolo'].get('engine', 'torch')
+        logging.info(f"Loading {engine_name} model from {dataset_path}")
+        timer = PhaseTimer()
+        timer.add('imports', IMPORTED_AT - STARTED_AT)
+        model = load_engine(dataset_path, engine_name, timer=timer)
         
         logging.info("Model loaded successfully")
-        return model, device
+        timer.log()
+        return model, model.device
     except Exception as e:
         logging.error(f"Error loading model: {str(e)}")
         logging.exception("Full traceback:")
@@ -47,6 +55,17 @@ def create_app(dataset_path):
 
     # Register source routes
     app.register_blueprint(source_routes, url_prefix='/api/sources')
+    app.register_blueprint(model_routes)
+    app.register_blueprint(detection_routes, url_prefix='/api/detections')
+
+    # Indexes behind the detection query API
+    try:
+        Detection.ensure_indexes()
+    except Exception as e:
+        logging.error(f"Error creating detection indexes: {str(e)}")
+
+    if config['mongodb'].get('watch_sources'):
+        Source.watch_changes()
 
     @app.route('/')
     def index():
@@ -64,13 +83,19 @@ def create_app(dataset_path):
                 'path': dataset_path,
                 'device': str(app.stream_controller.device),
                 'labels': app.stream_controller.labels,
-                'status': 'loaded'
+                'status': 'loaded',
+                'metrics': metrics.snapshot()
             }
             return jsonify(info)
         except Exception as e:
             logging.error(f"Error getting model info: {str(e)}")
             return jsonify({'error': str(e)}), 500
 
+    @app.route('/api/metrics')
+    def get_metrics():
+        """Per-stream, per-stage metrics in Prometheus text format"""
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
     # Socket.IO setup
     socketio = SocketIO(
         app,
@@ -86,9 +111,24 @@ def create_app(dataset_path):
     def handle_start_stream(data):
         source_id = data.get('sourceId')
         frame_rate = data.get('fps', 5)  # Default to 10 FPS
+        model_name = data.get('model')  # Default model when not given
+        mode = data.get('mode', 'overlay')  # overlay or detections (boxes drawn by the browser)
+        if mode not in ClientFlow.MODES:
+            logging.warning(f'Socket.IO: Unknown stream mode {mode}, using overlay')
+            mode = 'overlay'
         logging.info(f'Socket.IO: Starting stream for source: {source_id} at {frame_rate} FPS')
         if hasattr(app, 'stream_controller') and app.stream_controller is not None:
-            success = app.stream_controller.start_stream(source_id, frame_rate)
+            success = app.stream_controller.start_stream(source_id, frame_rate, model_name)
+            if success:
+                # Frames for this source are only sent to its subscribers
+                join_room(StreamController.room(source_id))
+                app.stream_controller.add_viewer(source_id, request.sid, frame_rate, mode)
+            else:
+                reason = app.stream_controller.rejection(source_id)
+                socketio.emit('streamRejected', {
+                    'sourceId': source_id,
+                    'reason': reason or 'Stream could not be started'
+                }, to=request.sid)
             logging.info(f'Stream start {"successful" if success else "failed"}')
         else:
             logging.error('No stream controller available')
@@ -97,12 +137,36 @@ def create_app(dataset_path):
     def handle_stop_stream(source_id):
         logging.info(f'Socket.IO: Stopping stream for source: {source_id}')
         if hasattr(app, 'stream_controller') and app.stream_controller is not None:
+            leave_room(StreamController.room(source_id))
+            remaining = app.stream_controller.remove_viewer(source_id, request.sid)
+            if remaining > 0:
+                logging.info(f'Stream for source {source_id} kept running for {remaining} other viewer(s)')
+                return
             success = app.stream_controller.stop_stream(source_id)
             logging.info(f'Stream stop {"successful" if success else "failed"}')
             
+    @socketio.on('setModel')
+    def handle_set_model(data):
+        source_id = data.get('sourceId')
+        model_name = data.get('model')
+        logging.info(f'Socket.IO: Switching source {source_id} to model {model_name}')
+        if hasattr(app, 'stream_controller') and app.stream_controller is not None:
+            success = app.stream_controller.set_model(source_id, model_name)
+            socketio.emit('modelChanged', {
+                'sourceId': source_id,
+                'model': app.stream_controller.stream_model(source_id),
+                'success': success
+            }, to=StreamController.room(source_id))
+
     @socketio.on('disconnect')
     def handle_disconnect():
         logging.info('Socket.IO: Client disconnected')
+        if hasattr(app, 'stream_controller') and app.stream_controller is not None:
+            # Rooms are left automatically; stop streams nobody is watching anymore.
+            # Directory and video jobs keep running, they are worth finishing unattended.
+            for source_id in app.stream_controller.remove_client(request.sid):
+                if not app.stream_controller.is_job(source_id):
+                    app.stream_controller.stop_stream(source_id)
 
     # Verify dataset directory
     if not os.path.isdir(dataset_path):
@@ -116,7 +180,7 @@ def create_app(dataset_path):
         return None
 
     # Load model
-    model, device = load_model(model_path)
+    model, device = load_model(dataset_path)
     if model is None:
         return None
 
@@ -130,8 +194,14 @@ def create_app(dataset_path):
         logging.error("Labels file not found")
         return None
 
+    # Register the startup model; others are loaded on demand from the dataset base directory
+    model_name = os.path.basename(os.path.normpath(dataset_path))
+    registry = ModelRegistry()
+    registry.add(model_name, model, labels, dataset_path)
+
     # Initialize StreamController
-    app.stream_controller = StreamController(socketio, model, labels, device)
+    app.stream_controller = StreamController(socketio, model, labels, device,
+                                             model_name=model_name, registry=registry)
     logging.info("StreamController initialized successfully")
 
     return app, socketio
@@ -159,3 +229,6 @@ if __name__ == '__main__':
         )
     except Exception as e:
         logging.error(f"Failed to start server: {str(e)}")
+    finally:
+        # Flush queued detections, stop the inference workers (freeing their shared memory) and close the cameras
+        app.stream_controller.cleanup()
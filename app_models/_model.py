@@ -1,10 +1,19 @@
 import os
 import yaml
 import logging
+import threading
 from app_utils.config import config as app_config
 
 class Model:
-    BASE_DIR = config['yolo']['dataset_base_dir']
+    BASE_DIR = app_config['yolo']['dataset_base_dir']
+    REQUIRED_FILES = ['best.pt', 'data.yaml', 'labels.txt']
+
+    # Scan cache: directory listing keyed by the base directory mtime, and one
+    # entry per model directory keyed by the mtimes of the directory and its files
+    _scan_lock = threading.Lock()
+    _base_mtime = None
+    _directories = []
+    _entries = {}
 
     def __init__(self, name, directory, labels=None, config_file=None, weight_file=None):
         self.name = name
@@ -13,34 +22,75 @@ class Model:
         self.config_file = config_file
         self.weight_file = weight_file
 
+    @staticmethod
+    def _signature(dir_path):
+        """mtimes that change whenever a model directory or its files change"""
+        signature = [os.stat(dir_path).st_mtime_ns]
+        for file_name in Model.REQUIRED_FILES:
+            try:
+                signature.append(os.stat(os.path.join(dir_path, file_name)).st_mtime_ns)
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    @staticmethod
+    def _read_model(dir_name, dir_path, signature):
+        """Build the model entry for a directory, or None if it isn't a complete model"""
+        if None in signature:
+            return None
+
+        # Read labels
+        labels_path = os.path.join(dir_path, 'labels.txt')
+        with open(labels_path, 'r') as f:
+            labels = [line.strip() for line in f if line.strip()]
+        
+        logging.info(f"Found model in directory: {dir_name}")
+        return {
+            'name': dir_name,
+            'directory': dir_name,
+            'labels': labels,
+            'configFile': os.path.join(dir_path, 'data.yaml'),
+            'weightFile': os.path.join(dir_path, 'best.pt')
+        }
+
     @staticmethod
     def scan_models():
-        """Scan the dataset directory for models"""
+        """Scan the dataset directory for models, re-reading only directories that changed"""
         models = []
         try:
-            directories = os.listdir(Model.BASE_DIR)
-            
-            for dir_name in directories:
-                dir_path = os.path.join(Model.BASE_DIR, dir_name)
-                if os.path.isdir(dir_path):
-                    # Check for required files
-                    files = os.listdir(dir_path)
-                    if all(f in files for f in ['best.pt', 'data.yaml', 'labels.txt']):
-                        # Read labels
-                        labels_path = os.path.join(dir_path, 'labels.txt')
-                        with open(labels_path, 'r') as f:
-                            labels = [line.strip() for line in f if line.strip()]
-                        
-                        models.append({
-                            'name': dir_name,
-                            'directory': dir_name,
-                            'labels': labels,
-                            'configFile': os.path.join(dir_path, 'data.yaml'),
-                            'weightFile': os.path.join(dir_path, 'best.pt')
-                        })
-                        logging.info(f"Found model in directory: {dir_name}")
+            with Model._scan_lock:
+                base_mtime = os.stat(Model.BASE_DIR).st_mtime_ns
+                if base_mtime != Model._base_mtime:
+                    Model._directories = sorted(
+                        d for d in os.listdir(Model.BASE_DIR)
+                        if os.path.isdir(os.path.join(Model.BASE_DIR, d))
+                    )
+                    Model._base_mtime = base_mtime
+
+                entries = {}
+                for dir_name in Model._directories:
+                    dir_path = os.path.join(Model.BASE_DIR, dir_name)
+                    try:
+                        signature = Model._signature(dir_path)
+                    except FileNotFoundError:
+                        continue
+                    cached = Model._entries.get(dir_name)
+                    if cached is None or cached[0] != signature:
+                        cached = (signature, Model._read_model(dir_name, dir_path, signature))
+                    entries[dir_name] = cached
+                    if cached[1] is not None:
+                        models.append(dict(cached[1], labels=list(cached[1]['labels'])))
+                Model._entries = entries
             
             return models
         except Exception as e:
             logging.error(f"Error scanning models: {str(e)}")
             raise
+
+    @staticmethod
+    def get_by_name(name):
+        """Look up a scanned model by name"""
+        for model in Model.scan_models():
+            if model['name'] == name:
+                return model
+        return None
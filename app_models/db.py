@@ -0,0 +1,229 @@
+import copy
+import logging
+import operator
+import threading
+from types import SimpleNamespace
+from bson import ObjectId
+from app_utils.config import config
+
+# Shared client, created on first use so importing the models never touches the database
+_client = None
+_client_lock = threading.Lock()
+
+# Comparison operators the memory backend understands, in queries and expressions
+COMPARISONS = {
+    '$eq': operator.eq,
+    '$ne': operator.ne,
+    '$gt': operator.gt,
+    '$gte': operator.ge,
+    '$lt': operator.lt,
+    '$lte': operator.le
+}
+
+class UnsupportedQuery(Exception):
+    """A query the built-in memory backend can't run; it needs MongoDB or mongomock"""
+
+class MemoryCollection:
+    """Minimal in-process stand-in for a Mongo collection, for tests and runs without a database.
+
+    Supports the operations the models use, with filters made of field values, the
+    comparison operators, $elemMatch, $and and $or. Aggregation covers the $match,
+    $sort, $limit and $addFields ($filter) stages of the detection listing; counts
+    and histograms raise UnsupportedQuery (install mongomock to run them in memory).
+    There are no change streams.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.documents = {}  # _id -> document
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _matches(document, query):
+        for key, condition in (query or {}).items():
+            if key == '$and':
+                if not all(MemoryCollection._matches(document, part) for part in condition):
+                    return False
+            elif key == '$or':
+                if not any(MemoryCollection._matches(document, part) for part in condition):
+                    return False
+            elif not MemoryCollection._test(document.get(key), condition):
+                return False
+        return True
+
+    @staticmethod
+    def _test(value, condition):
+        """Whether a field value satisfies a condition: a plain value or {operator: operand}"""
+        if not (isinstance(condition, dict) and condition and all(key.startswith('$') for key in condition)):
+            return value == condition
+        for name, operand in condition.items():
+            if name == '$elemMatch':
+                if not isinstance(value, list) or not any(MemoryCollection._matches(item, operand) for item in value):
+                    return False
+            elif name in COMPARISONS:
+                if value is None and name != '$ne':
+                    return False
+                if not COMPARISONS[name](value, operand):
+                    return False
+            else:
+                raise UnsupportedQuery(f"The memory backend can't run the {name} query operator")
+        return True
+
+    @staticmethod
+    def _evaluate(expression, document, variables):
+        """Value of an aggregation expression: '$field', '$$variable.field', an operator or a literal"""
+        if isinstance(expression, str) and expression.startswith('$'):
+            if expression.startswith('$$'):
+                name, _, path = expression[2:].partition('.')
+                value = variables.get(name)
+            else:
+                value, path = document, expression[1:]
+            for part in path.split('.') if path else []:
+                value = value.get(part) if isinstance(value, dict) else None
+            return value
+        if not isinstance(expression, dict):
+            return expression
+        (name, operand), = expression.items()
+        if name == '$filter':
+            items = MemoryCollection._evaluate(operand['input'], document, variables) or []
+            return [item for item in items
+                    if MemoryCollection._evaluate(operand['cond'], document, {**variables, operand['as']: item})]
+        if name == '$and':
+            return all(MemoryCollection._evaluate(part, document, variables) for part in operand)
+        if name in COMPARISONS:
+            left, right = (MemoryCollection._evaluate(part, document, variables) for part in operand)
+            return left is not None and COMPARISONS[name](left, right)
+        raise UnsupportedQuery(f"The memory backend can't evaluate {name}")
+
+    def find(self, query=None):
+        with self.lock:
+            return [copy.deepcopy(d) for d in self.documents.values() if self._matches(d, query)]
+
+    def find_one(self, query=None):
+        found = self.find(query)
+        return found[0] if found else None
+
+    def insert_one(self, document):
+        # Like pymongo, the inserted document gets its _id set
+        document.setdefault('_id', ObjectId())
+        with self.lock:
+            self.documents[document['_id']] = copy.deepcopy(document)
+        return SimpleNamespace(inserted_id=document['_id'])
+
+    def insert_many(self, documents, ordered=True):
+        return SimpleNamespace(inserted_ids=[self.insert_one(document).inserted_id for document in documents])
+
+    def update_one(self, query, update):
+        with self.lock:
+            for document in self.documents.values():
+                if self._matches(document, query):
+                    changes = update.get('$set', {})
+                    modified = any(document.get(key) != value for key, value in changes.items())
+                    document.update(copy.deepcopy(changes))
+                    return SimpleNamespace(matched_count=1, modified_count=int(modified))
+        return SimpleNamespace(matched_count=0, modified_count=0)
+
+    def delete_one(self, query):
+        with self.lock:
+            for key, document in self.documents.items():
+                if self._matches(document, query):
+                    del self.documents[key]
+                    return SimpleNamespace(deleted_count=1)
+        return SimpleNamespace(deleted_count=0)
+
+    def create_index(self, keys, **kwargs):
+        return '_'.join(f"{field}_{direction}" for field, direction in keys)
+
+    def aggregate(self, pipeline, **kwargs):
+        """Run a pipeline of $match, $sort, $limit and $addFields stages"""
+        documents = self.find()
+        for stage in pipeline:
+            (name, spec), = stage.items()
+            if name == '$match':
+                documents = [document for document in documents if self._matches(document, spec)]
+            elif name == '$sort':
+                # Stable sorts, least significant key first
+                for key, direction in reversed(list(spec.items())):
+                    documents.sort(key=lambda document: document.get(key), reverse=direction < 0)
+            elif name == '$limit':
+                documents = documents[:spec]
+            elif name == '$addFields':
+                for document in documents:
+                    document.update({field: self._evaluate(expression, document, {})
+                                     for field, expression in spec.items()})
+            else:
+                raise UnsupportedQuery(f"The memory backend can't run the {name} stage; "
+                                       f"use MongoDB or install mongomock")
+        return iter(documents)
+
+class MemoryDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name):
+        # setdefault is atomic, so concurrent first use gets one collection
+        return self.collections.setdefault(name, MemoryCollection(name))
+
+class MemoryClient:
+    """Client over MemoryDatabases, keyed by database name"""
+
+    def __init__(self):
+        self.databases = {}
+
+    def __getitem__(self, name):
+        return self.databases.setdefault(name, MemoryDatabase())
+
+    def close(self):
+        pass
+
+def _create_client():
+    mongodb = config['mongodb']
+    backend = mongodb.get('backend', 'mongo')
+    if backend == 'memory':
+        try:
+            import mongomock
+            logging.info("Using the mongomock in-memory database")
+            return mongomock.MongoClient()
+        except ImportError:
+            logging.info("Using the built-in in-memory database")
+            return MemoryClient()
+    if backend != 'mongo':
+        raise ValueError(f"mongodb.backend must be 'mongo' or 'memory', not {backend}")
+
+    from pymongo import MongoClient
+    pool = mongodb.get('pool', {})
+    # The client connects in the background; the first operation waits for server selection
+    client = MongoClient(mongodb['uri'],
+                         maxPoolSize=pool.get('max_pool_size', 50),
+                         minPoolSize=pool.get('min_pool_size', 0),
+                         maxIdleTimeMS=pool.get('max_idle_time_ms'),
+                         connectTimeoutMS=pool.get('connect_timeout_ms', 5000),
+                         serverSelectionTimeoutMS=pool.get('server_selection_timeout_ms', 5000))
+    logging.info(f"MongoDB client created (pool size {pool.get('max_pool_size', 50)})")
+    return client
+
+def get_client():
+    """The process-wide client, created on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _create_client()
+    return _client
+
+def get_database():
+    return get_client()[config['mongodb']['database']]
+
+class LazyCollection:
+    """Collection handle that resolves the client on first use"""
+
+    def __init__(self, key):
+        self.key = key  # Key in mongodb.collections
+
+    def __getattr__(self, attribute):
+        collection = get_database()[config['mongodb']['collections'][self.key]]
+        return getattr(collection, attribute)
+
+def collection(key):
+    """Lazy handle for one of the collections named in mongodb.collections"""
+    return LazyCollection(key)
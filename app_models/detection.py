@@ -0,0 +1,280 @@
+from bson import ObjectId
+from datetime import datetime, timedelta
+import logging
+import queue
+import threading
+import time
+from app_utils.config import config
+from app_utils.metrics import detection_write_seconds, detections_dropped, detections_written
+from app_models.db import collection
+
+detections_collection = collection('detections')
+
+# Index directions, as pymongo defines them; kept here so the memory backend runs without pymongo
+ASCENDING = 1
+DESCENDING = -1
+
+# Timestamps are naive UTC datetimes, as stored by Mongo with millisecond precision
+EPOCH = datetime(1970, 1, 1)
+
+class Detection:
+    """Everything the model found in one frame, stored as a single document.
+
+    Boxes are kept as an array per frame with short keys (l = label, c = confidence,
+    b = [x1, y1, x2, y2] in source-frame pixels), so a busy stream writes one small
+    document per frame instead of one per box.
+    """
+
+    def __init__(self, source_id, model, boxes, labels, timestamp=None, frame=None):
+        self.source_id = source_id
+        self.model = model
+        self.boxes = boxes if boxes is not None else []
+        self.labels = labels
+        self.timestamp = timestamp or datetime.utcnow()
+        self.frame = frame  # File name or frame index for directory and video sources
+
+    def to_dict(self):
+        detections = []
+        for x1, y1, x2, y2, conf, cls_id in self.boxes:
+            cls_id = int(cls_id)
+            detections.append({
+                'l': self.labels[cls_id] if cls_id < len(self.labels) else str(cls_id),
+                'c': round(float(conf), 3),
+                'b': [int(x1), int(y1), int(x2), int(y2)]
+            })
+        document = {
+            'sourceId': self.source_id,
+            'model': self.model,
+            'timestamp': self.timestamp,
+            'detections': detections
+        }
+        if self.frame is not None:
+            document['frame'] = self.frame
+        return document
+
+    @staticmethod
+    def ensure_indexes():
+        """Create the compound indexes the query API relies on (no-op when they exist)"""
+        # _id last so the (timestamp, _id) sort of paginated queries is served by the index
+        newest = [('timestamp', DESCENDING), ('_id', DESCENDING)]
+        detections_collection.create_index([('sourceId', ASCENDING)] + newest)
+        detections_collection.create_index([('sourceId', ASCENDING), ('detections.l', ASCENDING)] + newest)
+        detections_collection.create_index([('detections.l', ASCENDING)] + newest)
+        detections_collection.create_index(newest)
+        logging.info("Detection indexes in place")
+
+    @staticmethod
+    def _match(source_id=None, start=None, end=None, label=None, min_confidence=None):
+        """Frame-level filter: frames with at least one box matching label and confidence"""
+        match = {}
+        if source_id:
+            match['sourceId'] = source_id
+        if start or end:
+            match['timestamp'] = {}
+            if start:
+                match['timestamp']['$gte'] = start
+            if end:
+                match['timestamp']['$lt'] = end
+        box = Detection._box_match(label, min_confidence)
+        if box:
+            match['detections'] = {'$elemMatch': box}
+        return match
+
+    @staticmethod
+    def _box_match(label=None, min_confidence=None):
+        box = {}
+        if label:
+            box['l'] = label
+        if min_confidence is not None:
+            box['c'] = {'$gte': min_confidence}
+        return box
+
+    @staticmethod
+    def encode_cursor(document):
+        """Opaque position of a document in (timestamp, _id) descending order"""
+        millis = (document['timestamp'] - EPOCH) // timedelta(milliseconds=1)
+        return f"{millis}_{document['_id']}"
+
+    @staticmethod
+    def _after(cursor):
+        """Filter for the documents that come after a cursor"""
+        try:
+            millis, object_id = cursor.split('_', 1)
+            timestamp = EPOCH + timedelta(milliseconds=int(millis))
+            object_id = ObjectId(object_id)
+        except Exception:
+            raise ValueError(f"Invalid cursor: {cursor}")
+        return {'$or': [
+            {'timestamp': {'$lt': timestamp}},
+            {'timestamp': timestamp, '_id': {'$lt': object_id}}
+        ]}
+
+    @staticmethod
+    def find(source_id=None, start=None, end=None, label=None, min_confidence=None, limit=100, after=None):
+        """Newest frames first, with only the matching boxes of each frame.
+
+        Returns (documents, cursor); pass the cursor back as after= for the next page.
+        """
+        match = Detection._match(source_id, start, end, label, min_confidence)
+        if after:
+            match = {'$and': [match, Detection._after(after)]} if match else Detection._after(after)
+
+        pipeline = [
+            {'$match': match},
+            {'$sort': {'timestamp': -1, '_id': -1}},
+            {'$limit': limit}
+        ]
+        box = Detection._box_match(label, min_confidence)
+        if box:
+            conditions = []
+            if label:
+                conditions.append({'$eq': ['$$box.l', label]})
+            if min_confidence is not None:
+                conditions.append({'$gte': ['$$box.c', min_confidence]})
+            pipeline.append({'$addFields': {'detections': {'$filter': {
+                'input': '$detections', 'as': 'box', 'cond': {'$and': conditions}
+            }}}})
+
+        documents = list(detections_collection.aggregate(pipeline))
+        cursor = Detection.encode_cursor(documents[-1]) if len(documents) == limit else None
+        return documents, cursor
+
+    @staticmethod
+    def counts(source_id=None, start=None, end=None, label=None, min_confidence=None, bucket_seconds=3600):
+        """Boxes per label per time bucket, counted by the server"""
+        bucket_ms = int(bucket_seconds * 1000)
+        millis = {'$toLong': '$timestamp'}
+        pipeline = [
+            {'$match': Detection._match(source_id, start, end, label, min_confidence)},
+            {'$unwind': '$detections'}
+        ]
+        box = Detection._box_match(label, min_confidence)
+        if box:
+            pipeline.append({'$match': {f'detections.{key}': value for key, value in box.items()}})
+        pipeline += [
+            {'$group': {
+                '_id': {
+                    'time': {'$toDate': {'$subtract': [millis, {'$mod': [millis, bucket_ms]}]}},
+                    'label': '$detections.l'
+                },
+                'count': {'$sum': 1}
+            }},
+            {'$group': {
+                '_id': '$_id.time',
+                'counts': {'$push': {'k': '$_id.label', 'v': '$count'}},
+                'total': {'$sum': '$count'}
+            }},
+            {'$sort': {'_id': 1}},
+            {'$project': {'_id': 0, 'time': '$_id', 'total': 1, 'counts': {'$arrayToObject': '$counts'}}}
+        ]
+        return list(detections_collection.aggregate(pipeline, allowDiskUse=True))
+
+    @staticmethod
+    def confidence_histogram(source_id=None, start=None, end=None, label=None, bins=10):
+        """Number of boxes per confidence bin, counted by the server"""
+        boundaries = [round(i / bins, 6) for i in range(bins)] + [1.000001]
+        pipeline = [
+            {'$match': Detection._match(source_id, start, end, label)},
+            {'$unwind': '$detections'}
+        ]
+        if label:
+            pipeline.append({'$match': {'detections.l': label}})
+        pipeline += [
+            {'$bucket': {
+                'groupBy': '$detections.c',
+                'boundaries': boundaries,
+                'default': 'other',
+                'output': {'count': {'$sum': 1}}
+            }},
+            {'$project': {'_id': 0, 'from': '$_id', 'count': 1}}
+        ]
+        return list(detections_collection.aggregate(pipeline, allowDiskUse=True))
+
+class DetectionWriter:
+    """Stores detection documents from all streams with batched insert_many on a background thread.
+
+    A batch is written once it reaches batch_size documents or flush_interval seconds
+    after its first document. The queue is bounded: when Mongo falls behind, new
+    documents are dropped rather than making the processing threads wait.
+    """
+
+    def __init__(self, collection=None, batch_size=None, flush_interval=None, max_queue=None):
+        persistence = config.get('detections', {})
+        self.collection = collection if collection is not None else detections_collection
+        self.batch_size = batch_size or persistence.get('batch_size', 500)
+        self.flush_interval = flush_interval or persistence.get('flush_interval', 1.0)
+        self.store_empty = persistence.get('store_empty', False)
+        self.queue = queue.Queue(maxsize=max_queue or persistence.get('max_queue', 10000))
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """Start the writer thread"""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        logging.info(f"Detection writer started (batch {self.batch_size}, flush every {self.flush_interval}s)")
+
+    def stop(self):
+        """Stop the writer thread after flushing what is queued"""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+        logging.info("Detection writer stopped")
+
+    def add(self, detection, wait=False):
+        """Queue a Detection for storage, returning False if it was dropped.
+
+        Live streams never wait; jobs can pass wait=True to block until there is room,
+        which only fails once the writer has stopped. Documents are built on the writer
+        thread, not the caller's.
+        """
+        if len(detection.boxes) == 0 and not self.store_empty:
+            return True
+        while True:
+            try:
+                self.queue.put(detection, block=wait, timeout=1.0 if wait else None)
+                return True
+            except queue.Full:
+                if not wait or not self.running:
+                    break
+        detections_dropped.inc(reason='queue_full')
+        return False
+
+    def _next_batch(self):
+        """Block for the first document, then collect until the batch is full or the interval ends"""
+        try:
+            batch = [self.queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        started = time.perf_counter()
+        try:
+            # Unordered, so one bad document doesn't stop the rest of the batch
+            self.collection.insert_many([detection.to_dict() for detection in batch], ordered=False)
+            detections_written.inc(len(batch))
+        except Exception as e:
+            logging.error(f"Error storing {len(batch)} detection documents: {str(e)}")
+            detections_dropped.inc(len(batch), reason='write_error')
+        detection_write_seconds.observe(time.perf_counter() - started)
+
+    def _run(self):
+        while self.running or not self.queue.empty():
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+        logging.info("Detection writer thread stopped")
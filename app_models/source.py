@@ -1,25 +1,28 @@
 from bson import ObjectId
 from datetime import datetime
+import copy
 import logging
+import threading
+import time
 from app_utils.config import config  # Update this import
-from pymongo import MongoClient
-
-# MongoDB connection using config
-try:
-    client = MongoClient(config['mongodb']['uri'])
-    # Test the connection
-    client.server_info()
-    db = client[config['mongodb']['database']]
-    sources_collection = db[config['mongodb']['collections']['sources']]
-    logging.info("Successfully connected to MongoDB")
-except Exception as e:
-    logging.error(f"Failed to connect to MongoDB: {str(e)}")
-    raise
+from app_models.db import collection
+
+# Connects on first use, not at import
+sources_collection = collection('sources')
 
 class Source:
     TYPES = ['camera', 'directory', 'video']
+    # Config sections a source can override with a field of the same name (see source_settings)
+    SETTINGS = ['encoding', 'motion', 'tracking', 'tiling', 'admission']
+
+    # Read-through cache of source documents, invalidated on update and delete.
+    # Entries also expire after mongodb.source_cache_ttl seconds to pick up changes
+    # made by other processes when change streams aren't available.
+    _cache_lock = threading.Lock()
+    _cache = {}   # source_id -> (document, cached_at)
+    _all = None   # (documents, cached_at) as returned by get_all
 
-    def __init__(self, type, name, frame_rate=1, connection_details=None):
+    def __init__(self, type, name, frame_rate=1, connection_details=None, settings=None):
         if type not in self.TYPES:
             raise ValueError(f"Type must be one of {self.TYPES}")
         
@@ -27,12 +30,22 @@ class Source:
         self.name = name
         self.frame_rate = frame_rate
         self.connection_details = connection_details or {}
+        self.settings = {}  # section -> overrides, e.g. {'encoding': {'quality': 60}}
+        for section, overrides in (settings or {}).items():
+            if section not in self.SETTINGS:
+                raise ValueError(f"Settings section must be one of {self.SETTINGS}")
+            if overrides is not None and not isinstance(overrides, dict):
+                raise ValueError(f"{section} settings must be an object")
+            if overrides:
+                self.settings[section] = overrides
         
         # Validate connection details for camera type
         if type == 'camera':
             required_fields = ['address', 'user', 'password']
             if not all(field in self.connection_details for field in required_fields):
                 raise ValueError("Camera type requires address, user, and password")
+        elif not self.connection_details.get('path'):
+            raise ValueError(f"{type.capitalize()} type requires a path")
 
     @staticmethod
     def from_dict(data):
@@ -40,11 +53,12 @@ class Source:
             type=data.get('type'),
             name=data.get('name'),
             frame_rate=data.get('frameRate', 1),
-            connection_details=data.get('connectionDetails', {})
+            connection_details=data.get('connectionDetails', {}),
+            settings={section: data[section] for section in Source.SETTINGS if section in data}
         )
 
     def to_dict(self):
-        return {
+        document = {
             'type': self.type,
             'name': self.name,
             'frameRate': self.frame_rate,
@@ -52,13 +66,55 @@ class Source:
             'createdAt': datetime.utcnow(),
             'updatedAt': datetime.utcnow()
         }
+        document.update(self.settings)
+        return document
+
+    @staticmethod
+    def _fresh(cached_at):
+        ttl = config['mongodb'].get('source_cache_ttl', 60)
+        return ttl is None or time.monotonic() - cached_at < ttl
+
+    @staticmethod
+    def invalidate(source_id=None):
+        """Drop a source (or all of them) from the cache"""
+        with Source._cache_lock:
+            if source_id is None:
+                Source._cache.clear()
+            else:
+                Source._cache.pop(source_id, None)
+            Source._all = None
+
+    @staticmethod
+    def watch_changes():
+        """Invalidate cached sources when any process changes them (needs a replica set)"""
+        def watch():
+            try:
+                with sources_collection.watch() as stream:
+                    for change in stream:
+                        key = change.get('documentKey', {}).get('_id')
+                        Source.invalidate(str(key) if key is not None else None)
+            except Exception as e:
+                logging.warning(f"Source change stream unavailable, relying on the cache TTL: {str(e)}")
+
+        thread = threading.Thread(target=watch)
+        thread.daemon = True
+        thread.start()
 
     @staticmethod
     def get_all():
         try:
-            sources = list(sources_collection.find())
+            with Source._cache_lock:
+                if Source._all is not None and Source._fresh(Source._all[1]):
+                    return copy.deepcopy(Source._all[0])
+
+            sources = [{**s, '_id': str(s['_id'])} for s in sources_collection.find()]
             logging.info(f"Retrieved {len(sources)} sources from MongoDB")
-            return [{**s, '_id': str(s['_id'])} for s in sources]
+            now = time.monotonic()
+            with Source._cache_lock:
+                Source._all = (copy.deepcopy(sources), now)
+                for source in sources:
+                    Source._cache[source['_id']] = (copy.deepcopy(source), now)
+            return sources
         except Exception as e:
             logging.error(f"Error retrieving sources: {str(e)}")
             raise
@@ -66,10 +122,17 @@ class Source:
     @staticmethod
     def get_by_id(source_id):
         try:
+            with Source._cache_lock:
+                cached = Source._cache.get(source_id)
+                if cached is not None and Source._fresh(cached[1]):
+                    return copy.deepcopy(cached[0])
+
             source = sources_collection.find_one({'_id': ObjectId(source_id)})
             if source:
                 source['_id'] = str(source['_id'])
                 logging.info(f"Retrieved source {source_id}")
+                with Source._cache_lock:
+                    Source._cache[source_id] = (copy.deepcopy(source), time.monotonic())
             else:
                 logging.warning(f"Source {source_id} not found")
             return source
@@ -81,6 +144,7 @@ class Source:
         try:
             result = sources_collection.insert_one(self.to_dict())
             source_id = str(result.inserted_id)
+            Source.invalidate(source_id)
             logging.info(f"Saved new source with ID: {source_id}")
             return source_id
         except Exception as e:
@@ -100,6 +164,7 @@ class Source:
                 {'_id': ObjectId(source_id)},
                 {'$set': data}
             )
+            Source.invalidate(source_id)
             
             if result.matched_count == 0:
                 raise ValueError(f"Source with id {source_id} not found")
@@ -114,6 +179,7 @@ class Source:
     def delete(source_id):
         try:
             result = sources_collection.delete_one({'_id': ObjectId(source_id)})
+            Source.invalidate(source_id)
             logging.info(f"Deleted source {source_id}, deleted count: {result.deleted_count}")
             return result.deleted_count > 0
         except Exception as e:
@@ -1,3 +1,4 @@
+import copy
 import yaml
 import os
 from pathlib import Path
@@ -10,6 +11,32 @@ def setup_logging(config):
         datefmt=config['logging']['date_format']
     )
 
+# Settings that moved, as (old path, new path); configs still using an old path keep working
+MOVED_KEYS = [
+    (('rtsp', 'frame', 'width'), ('encoding', 'width')),
+    (('rtsp', 'frame', 'height'), ('encoding', 'height')),
+    (('streaming', 'jpeg_quality'), ('encoding', 'quality')),
+    (('admission', 'default_priority'), ('admission', 'priority')),
+    (('admission', 'default_weight'), ('admission', 'weight')),
+]
+
+def migrate_config(config):
+    """Copy settings found under an old path to their new one, unless the new one is set"""
+    for old, new in MOVED_KEYS:
+        value = config
+        for key in old:
+            value = value.get(key) if isinstance(value, dict) else None
+        if value is None:
+            continue
+        section = config
+        for key in new[:-1]:
+            if not isinstance(section.get(key), dict):
+                section[key] = {}
+            section = section[key]
+        if section.get(new[-1]) is None:
+            section[new[-1]] = value
+            logging.warning(f"Config setting {'.'.join(old)} is deprecated, use {'.'.join(new)}")
+
 def load_config():
     try:
         config_path = Path(__file__).parent.parent / 'config.yaml'
@@ -19,6 +46,8 @@ def load_config():
         # Override with environment variables if they exist
         if os.getenv('MONGODB_URI'):
             config['mongodb']['uri'] = os.getenv('MONGODB_URI')
+        if os.getenv('MONGODB_BACKEND'):
+            config['mongodb']['backend'] = os.getenv('MONGODB_BACKEND')
         if os.getenv('DATASET_BASE_DIR'):
             config['yolo']['dataset_base_dir'] = os.getenv('DATASET_BASE_DIR')
         if os.getenv('FLASK_SECRET_KEY'):
@@ -28,11 +57,26 @@ def load_config():
         
         # Setup logging
         setup_logging(config)
+        migrate_config(config)
         
         return config
     except Exception as e:
         print(f"Error loading config: {str(e)}")
         raise
 
+def source_settings(section, source=None, defaults=None):
+    """A config section with a source's overrides applied.
+
+    defaults, kept next to the code that uses the section, fill in whatever
+    config.yaml leaves out; the source document's field of the same name may
+    override any of them. Unknown keys and null values in the source are ignored.
+    """
+    settings = copy.deepcopy(defaults or {})
+    settings.update(copy.deepcopy({key: value for key, value in (config.get(section) or {}).items()
+                                   if value is not None}))
+    overrides = (source or {}).get(section) or {}
+    settings.update({key: value for key, value in overrides.items() if key in settings and value is not None})
+    return settings
+
 # Create a global config object
 config = load_config()
@@ -0,0 +1,81 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from app_utils.config import config
+from app_utils.metrics import stage_seconds
+
+# Chroma subsampling name -> OpenCV sampling factor (absent before OpenCV 4.5.5)
+OPENCV_SAMPLING = {
+    name: getattr(cv2, f'IMWRITE_JPEG_SAMPLING_FACTOR_{name}', None)
+    for name in ('444', '422', '420', '411')
+}
+
+# Used for whatever the 'encoding' section of config.yaml leaves out
+ENCODING_DEFAULTS = {
+    'quality': 80,
+    'subsampling': '420',
+    'width': 800,
+    'height': 800
+}
+
+def check_encoding(settings):
+    """Validate encoding settings from source_settings('encoding', source), in place"""
+    # Sources given as JSON may carry the subsampling as a number
+    settings['subsampling'] = str(settings['subsampling'])
+    if settings['subsampling'] not in OPENCV_SAMPLING:
+        raise ValueError(f"Subsampling must be one of {list(OPENCV_SAMPLING.keys())}")
+    return settings
+
+class JpegEncoder:
+    """Encodes frames to JPEG on a thread pool shared by all streams.
+
+    Both OpenCV and libjpeg-turbo release the GIL while encoding, so the pool encodes
+    frames for several streams and quality levels in parallel with the processing
+    threads. libjpeg-turbo (through PyTurboJPEG) is used when it is installed.
+    """
+
+    def __init__(self, workers=None, backend=None):
+        encoding = config.get('encoding', {})
+        self.pool = ThreadPoolExecutor(max_workers=workers or encoding.get('workers', 4))
+        backend = backend or encoding.get('backend', 'auto')
+        self.turbo = None
+        if backend in ('auto', 'turbojpeg'):
+            try:
+                import turbojpeg
+                self.turbo = turbojpeg.TurboJPEG()
+                self.turbo_sampling = {
+                    '444': turbojpeg.TJSAMP_444,
+                    '422': turbojpeg.TJSAMP_422,
+                    '420': turbojpeg.TJSAMP_420,
+                    '411': turbojpeg.TJSAMP_411
+                }
+            except (ImportError, OSError) as e:
+                # OSError: the Python package is there but the libjpeg-turbo library isn't
+                if backend == 'turbojpeg':
+                    logging.warning(f"libjpeg-turbo unavailable, encoding with OpenCV: {str(e)}")
+        elif backend != 'opencv':
+            raise ValueError("encoding.backend must be 'auto', 'turbojpeg' or 'opencv'")
+        logging.info(f"JPEG encoder using {'libjpeg-turbo' if self.turbo else 'OpenCV'}")
+
+    def encode(self, frame, quality, subsampling='420', source_id=None):
+        """Encode a BGR frame on the calling thread"""
+        started = time.perf_counter()
+        if self.turbo is not None:
+            image = self.turbo.encode(frame, quality=quality, jpeg_subsample=self.turbo_sampling[subsampling])
+        else:
+            params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+            if OPENCV_SAMPLING.get(subsampling) is not None:
+                params += [cv2.IMWRITE_JPEG_SAMPLING_FACTOR, OPENCV_SAMPLING[subsampling]]
+            _, buffer = cv2.imencode('.jpg', frame, params)
+            image = buffer.tobytes()
+        if source_id is not None:
+            stage_seconds.observe(time.perf_counter() - started, source=source_id, stage='encode')
+        return image
+
+    def submit(self, frame, quality, subsampling='420', source_id=None):
+        """Encode on the pool; the frame must not change until the returned Future is done"""
+        return self.pool.submit(self.encode, frame, quality, subsampling, source_id)
+
+    def stop(self):
+        self.pool.shutdown(wait=True)
@@ -0,0 +1,325 @@
+import argparse
+import functools
+import logging
+import os
+from concurrent.futures import Future
+import numpy as np
+import torch
+from app_utils.config import config
+from app_utils.postprocess import non_max_suppression
+from app_utils.timing import PhaseTimer
+
+# Engine name -> file stored next to best.pt in the dataset directory
+EXPORT_FILES = {
+    'torchscript': 'best.torchscript',
+    'onnx': 'best.onnx',
+    'onnx-int8': 'best.int8.onnx'
+}
+
+def select_device():
+    """Use the configured device, falling back to cpu when cuda isn't available"""
+    requested = config['yolo']['model'].get('device', 'cuda')
+    if requested != 'cpu' and torch.cuda.is_available():
+        return torch.device(requested)
+    return torch.device('cpu')
+
+def export_path(dataset_path, engine_name):
+    """Where the export for an engine is stored.
+
+    TorchScript traces record the device of the tensors created while tracing, so
+    they are stored per device: best.torchscript for cpu, best.cuda.torchscript etc.
+    """
+    filename = EXPORT_FILES[engine_name]
+    if engine_name == 'torchscript':
+        device = select_device()
+        if device.type != 'cpu':
+            filename = f"best.{str(device).replace(':', '')}.torchscript"
+    return os.path.join(dataset_path, filename)
+
+def hub_repo_dir():
+    """Local checkout of the pinned YOLOv5 hub code"""
+    hub = config['yolo'].get('hub', {})
+    if hub.get('repo_dir'):
+        return os.path.expanduser(hub['repo_dir'])
+    # Same directory torch.hub would cache '<owner>/<repo>:<version>' in
+    owner, name = hub.get('repo', 'ultralytics/yolov5').split('/')
+    return os.path.join(torch.hub.get_dir(), f"{owner}_{name}_{hub.get('version', 'v7.0').replace('/', '_')}")
+
+def fetch_hub_repo():
+    """Download the pinned YOLOv5 hub code into the local cache (needs network, run once)"""
+    hub = config['yolo'].get('hub', {})
+    github = f"{hub.get('repo', 'ultralytics/yolov5')}:{hub.get('version', 'v7.0')}"
+    torch.hub.list(github, trust_repo=True, skip_validation=True)
+    logging.info(f"Cached {github} in {hub_repo_dir()}")
+
+def load_hub_model(weights_path, device, timer=None):
+    """Load best.pt through the YOLOv5 hub wrapper (letterbox + NMS included) from the local cache"""
+    timer = timer or PhaseTimer()
+    repo_dir = hub_repo_dir()
+    if not os.path.isdir(repo_dir):
+        if config['yolo'].get('hub', {}).get('offline', True):
+            raise FileNotFoundError(f"YOLOv5 hub code not found in {repo_dir}, "
+                                    f"run 'python -m app_utils.engines --fetch-hub' once with network access")
+        fetch_hub_repo()
+
+    with timer.phase('weights'):
+        model = torch.hub.load(repo_dir,
+                               'custom',
+                               path=weights_path,
+                               source='local',
+                               device='cpu')
+    with timer.phase('device'):
+        model = model.to(device)
+        model.eval()
+    model.conf = config['yolo']['confidence_threshold']
+    model.iou = config['yolo']['iou_threshold']
+    return model
+
+def _detection_network(hub_model):
+    """Unwrap AutoShape/DetectMultiBackend down to the bare DetectionModel"""
+    net = hub_model
+    while hasattr(net, 'model') and not isinstance(net.model, torch.nn.Sequential):
+        net = net.model
+    for module in net.modules():
+        if type(module).__name__ == 'Detect':
+            # Return the concatenated predictions only, as yolov5's own export does
+            module.inplace = False
+            module.export = True
+    return net.float().eval()
+
+class InferenceEngine:
+    """Runs batches of letterboxed RGB frames through a model.
+
+    Every engine takes a list of HxWx3 uint8 frames at yolo.model.image_size and
+    returns one Nx6 float array [x1, y1, x2, y2, conf, cls] per frame, in
+    model-input coordinates.
+    """
+    name = None
+
+    def __init__(self, dataset_path, device):
+        self.dataset_path = dataset_path
+        self.device = device
+        self.image_size = config['yolo']['model']['image_size']
+        self.conf_threshold = config['yolo']['confidence_threshold']
+        self.iou_threshold = config['yolo']['iou_threshold']
+
+    def __call__(self, frames):
+        raise NotImplementedError
+
+    def submit(self, frames):
+        """Run a batch and return a Future for its detections.
+
+        In-process engines complete it before returning; the worker pool returns
+        as soon as the batch has been handed to a worker.
+        """
+        future = Future()
+        try:
+            future.set_result(self(frames))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def close(self):
+        """Release anything held outside this object; nothing for in-process engines"""
+
+    @property
+    def weights_path(self):
+        """File the engine runs: best.pt or its export"""
+        if self.name in EXPORT_FILES:
+            return export_path(self.dataset_path, self.name)
+        return os.path.join(self.dataset_path, 'best.pt')
+
+    def memory_bytes(self):
+        """Rough resident size of the model, used for the registry's memory budget"""
+        path = self.weights_path
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def warmup(self, runs=None, batch_sizes=None):
+        """Run dummy batches at the input size so the first real frame doesn't pay one-time setup costs"""
+        warmup = config['yolo'].get('warmup', {})
+        runs = runs if runs is not None else warmup.get('runs', 2)
+        batch_sizes = batch_sizes or warmup.get('batch_sizes', [1])
+        width, height = self.image_size
+        frame = np.zeros((height, width, 3), dtype=np.uint8)
+        for batch_size in batch_sizes:
+            for _ in range(runs):
+                self([frame] * batch_size)
+
+class TorchEngine(InferenceEngine):
+    """Eager PyTorch model from torch.hub"""
+    name = 'torch'
+
+    def __init__(self, dataset_path, device, timer=None):
+        super().__init__(dataset_path, device)
+        self.model = load_hub_model(os.path.join(dataset_path, 'best.pt'), device, timer)
+
+    def __call__(self, frames):
+        results = self.model(frames, size=max(self.image_size))
+        return [det.cpu().numpy() for det in results.xyxy]
+
+    def memory_bytes(self):
+        tensors = list(self.model.parameters()) + list(self.model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+class RawOutputEngine(InferenceEngine):
+    """Base for exported models that return raw predictions and need NMS on our side"""
+
+    def __init__(self, dataset_path, device):
+        super().__init__(dataset_path, device)
+        self.input = None  # Reusable NCHW float32 batch buffer
+
+    def _prepare(self, frames):
+        """Pack frames into the reusable NCHW float32 buffer, scaled to 0..1"""
+        height, width = frames[0].shape[:2]
+        if self.input is None or self.input.shape[0] < len(frames) or self.input.shape[2:] != (height, width):
+            self.input = np.empty((len(frames), 3, height, width), dtype=np.float32)
+        batch = self.input[:len(frames)]
+        for i, frame in enumerate(frames):
+            np.divide(frame.transpose(2, 0, 1), 255.0, out=batch[i])
+        return batch
+
+    def _forward(self, batch):
+        raise NotImplementedError
+
+    def __call__(self, frames):
+        prediction = self._forward(self._prepare(frames))
+        return non_max_suppression(prediction, self.conf_threshold, self.iou_threshold)
+
+class TorchScriptEngine(RawOutputEngine):
+    """Traced TorchScript model, no Python-level module overhead.
+
+    The trace only runs on the device it was traced on (see export_path).
+    """
+    name = 'torchscript'
+
+    def __init__(self, dataset_path, device, timer=None):
+        super().__init__(dataset_path, device)
+        timer = timer or PhaseTimer()
+        path = export_path(dataset_path, self.name)
+        with timer.phase('weights'):
+            self.model = torch.jit.load(path, map_location=device)
+        with timer.phase('device'):
+            self.model.eval()
+
+    def _forward(self, batch):
+        with torch.inference_mode():
+            output = self.model(torch.from_numpy(batch).to(self.device))
+        if isinstance(output, (list, tuple)):
+            output = output[0]
+        return output.cpu().numpy()
+
+class OnnxEngine(RawOutputEngine):
+    """ONNX Runtime on the CPU execution provider"""
+    name = 'onnx'
+
+    def __init__(self, dataset_path, device, timer=None):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError(f"The '{self.name}' engine requires the onnxruntime package")
+        super().__init__(dataset_path, torch.device('cpu'))
+        timer = timer or PhaseTimer()
+        path = export_path(dataset_path, self.name)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        threads = config['yolo'].get('onnx', {}).get('intra_op_threads', 0)
+        if threads:
+            options.intra_op_num_threads = threads
+        with timer.phase('weights'):
+            self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def _forward(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+class QuantizedOnnxEngine(OnnxEngine):
+    """ONNX model with dynamically quantized int8 weights"""
+    name = 'onnx-int8'
+
+ENGINES = {engine.name: engine for engine in (TorchEngine, TorchScriptEngine, OnnxEngine, QuantizedOnnxEngine)}
+
+def export_model(dataset_path, engine_name):
+    """Convert best.pt for the given engine and store the result next to it"""
+    if engine_name not in EXPORT_FILES:
+        raise ValueError(f"Engine must be one of {list(EXPORT_FILES.keys())}")
+
+    target = export_path(dataset_path, engine_name)
+    if engine_name == 'onnx-int8':
+        # Quantize the float ONNX model, exporting that first if needed
+        source = export_path(dataset_path, 'onnx')
+        if not os.path.exists(source):
+            export_model(dataset_path, 'onnx')
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(source, target, weight_type=QuantType.QUInt8)
+        logging.info(f"Exported {engine_name} model to {target}")
+        return target
+
+    # ONNX Runtime runs on the cpu; TorchScript is traced on the device it will run on,
+    # since YOLOv5's Detect head creates its grids on the tracing device
+    device = select_device() if engine_name == 'torchscript' else torch.device('cpu')
+    net = _detection_network(load_hub_model(os.path.join(dataset_path, 'best.pt'), device))
+    width, height = config['yolo']['model']['image_size']
+    dummy = torch.zeros(1, 3, height, width, device=device)
+    with torch.no_grad():
+        if engine_name == 'torchscript':
+            traced = torch.jit.trace(net, dummy, strict=False)
+            traced.save(target)
+        else:
+            torch.onnx.export(net, dummy, target,
+                              opset_version=12,
+                              input_names=['images'],
+                              output_names=['output0'],
+                              dynamic_axes={'images': {0: 'batch'}, 'output0': {0: 'batch'}})
+    logging.info(f"Exported {engine_name} model to {target}")
+    return target
+
+def create_engine(dataset_path, engine_name, warmup=True):
+    """Build and warm up an engine in the current process; used by the inference workers"""
+    engine = ENGINES[engine_name](dataset_path, select_device())
+    if warmup:
+        engine.warmup()
+    return engine
+
+def load_engine(dataset_path, engine_name=None, timer=None, warmup=True):
+    """Create the configured inference engine, exporting the model once if needed, and warm it up.
+
+    With inference.workers set, the model runs in that many worker processes instead.
+    """
+    timer = timer or PhaseTimer()
+    engine_name = engine_name or config['yolo'].get('engine', 'torch')
+    if engine_name not in ENGINES:
+        raise ValueError(f"Engine must be one of {list(ENGINES.keys())}")
+
+    if engine_name in EXPORT_FILES and not os.path.exists(export_path(dataset_path, engine_name)):
+        logging.info(f"No {engine_name} model found in {dataset_path}, exporting it")
+        with timer.phase('export'):
+            export_model(dataset_path, engine_name)
+
+    workers = config.get('inference', {}).get('workers', 0)
+    if workers:
+        from app_utils.workers import WorkerPool
+        with timer.phase('workers'):
+            engine = WorkerPool(functools.partial(create_engine, dataset_path, engine_name, warmup), workers,
+                                weights_path=(export_path(dataset_path, engine_name) if engine_name in EXPORT_FILES
+                                              else os.path.join(dataset_path, 'best.pt')))
+        logging.info(f"Loaded {engine_name} engine in {engine.device}")
+        return engine
+
+    device = select_device()
+    engine = ENGINES[engine_name](dataset_path, device, timer)
+    if warmup:
+        with timer.phase('warmup'):
+            engine.warmup()
+    logging.info(f"Loaded {engine_name} engine on {engine.device}")
+    return engine
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export a dataset model for an inference engine')
+    parser.add_argument('dataset_path', nargs='?', help='Path to dataset directory containing best.pt')
+    parser.add_argument('--engine', choices=list(EXPORT_FILES.keys()), default='onnx')
+    parser.add_argument('--fetch-hub', action='store_true', help='Download the pinned YOLOv5 hub code into the local cache')
+    args = parser.parse_args()
+    if args.fetch_hub:
+        fetch_hub_repo()
+    if args.dataset_path:
+        export_model(args.dataset_path, args.engine)
@@ -0,0 +1,190 @@
+import bisect
+import threading
+
+# Latency buckets in seconds, from sub-millisecond encode times up to multi-second stalls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}  # label values tuple -> value
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def remove(self, **labels):
+        """Forget a label set, e.g. when a stream stops"""
+        with self.lock:
+            self.values.pop(self._key(labels), None)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            for key, value in self.values.items():
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+    def snapshot(self):
+        with self.lock:
+            return {','.join(key): value for key, value in self.values.items()}
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, plus sum and count
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', bound))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+    def _quantile(self, counts, count, q):
+        """Upper bucket bound below which a fraction q of observations fall"""
+        target = q * count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return bound
+        return float('inf')
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                ','.join(key): {
+                    'count': count,
+                    'avg': total / count if count else 0.0,
+                    'p50': self._quantile(counts, count, 0.5),
+                    'p95': self._quantile(counts, count, 0.95)
+                }
+                for key, (counts, total, count) in self.values.items()
+            }
+
+class MetricsRegistry:
+    """Holds all metrics and renders them in Prometheus text format"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def remove(self, **labels):
+        """Drop a label set from every metric that uses those labels"""
+        for metric in self.metrics:
+            if set(labels).issubset(metric.labelnames):
+                metric.remove(**labels)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+# Process-wide registry and the metrics the streaming pipeline reports
+metrics = MetricsRegistry()
+
+stage_seconds = metrics.histogram(
+    'modelviewer_stage_seconds', 'Time spent per processing stage', ('source', 'stage'))
+frame_age_seconds = metrics.gauge(
+    'modelviewer_frame_age_seconds', 'Age of the most recently processed frame when processing started', ('source',))
+frames_captured = metrics.counter(
+    'modelviewer_frames_captured_total', 'Frames decoded from the source', ('source',))
+frames_processed = metrics.counter(
+    'modelviewer_frames_processed_total', 'Frames run through the model and sent to viewers', ('source',))
+inference_skipped = metrics.counter(
+    'modelviewer_inference_skipped_total', 'Processed frames that reused the previous detections because the scene was static',
+    ('source',))
+inference_tracked = metrics.counter(
+    'modelviewer_inference_tracked_total', 'Processed frames whose boxes were predicted by the tracker between detections',
+    ('source',))
+frames_dropped = metrics.counter(
+    'modelviewer_frames_dropped_total', 'Frames dropped before reaching a viewer', ('source', 'reason'))
+stream_errors = metrics.counter(
+    'modelviewer_stream_errors_total', 'Errors that stopped a capture or processing thread', ('source', 'stage'))
+queue_depth = metrics.gauge(
+    'modelviewer_scheduler_queue_depth', 'Frames waiting for the next inference batch', ('model',))
+batch_seconds = metrics.histogram(
+    'modelviewer_batch_seconds', 'Forward pass time per inference batch', ('model',))
+batch_size = metrics.histogram(
+    'modelviewer_batch_size', 'Frames per inference batch', ('model',), buckets=(1, 2, 4, 8, 16, 32))
+viewers = metrics.gauge(
+    'modelviewer_viewers', 'Clients watching a source', ('source',))
+result_cache_lookups = metrics.counter(
+    'modelviewer_result_cache_lookups_total', 'Offline items looked up in the result cache', ('result',))
+detections_written = metrics.counter(
+    'modelviewer_detections_written_total', 'Detection documents stored in MongoDB')
+detections_dropped = metrics.counter(
+    'modelviewer_detections_dropped_total', 'Detection documents that could not be stored', ('reason',))
+detection_write_seconds = metrics.histogram(
+    'modelviewer_detection_write_seconds', 'Time per batched insert of detection documents')
@@ -0,0 +1,69 @@
+import cv2
+import numpy as np
+
+# Used for whatever the 'motion' section of config.yaml leaves out
+MOTION_DEFAULTS = {
+    'enabled': False,
+    'threshold': 25,
+    'min_area': 0.005,
+    'refresh_interval': 2.0,
+    'width': 160
+}
+
+class MotionGate:
+    """Decides whether a frame differs enough from the last one the model saw to be worth running.
+
+    Frames are compared as small blurred grayscale images against the frame of the last
+    inference rather than the previous frame, so slow changes add up instead of slipping
+    through one small step at a time. The model runs at least every refresh_interval
+    seconds regardless, so objects that stop moving are still re-detected.
+    """
+
+    def __init__(self, threshold=25, min_area=0.005, refresh_interval=2.0, width=160):
+        self.threshold = threshold
+        self.min_area = min_area
+        self.refresh_interval = refresh_interval
+        self.width = width
+        self.source_shape = None
+        self.small = None
+        self.gray = None
+        self.diff = None
+        self.reference = None
+        self.last_run = 0.0
+
+    def _fit(self, height, width):
+        size = (self.width, max(1, int(round(height * self.width / width))))
+        self.small = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        self.gray = np.empty((size[1], size[0]), dtype=np.uint8)
+        self.diff = np.empty_like(self.gray)
+        self.reference = None
+        self.source_shape = (height, width)
+
+    def __call__(self, frame, now):
+        """True if the model should run on this frame, False to reuse the previous detections"""
+        height, width = frame.shape[:2]
+        if (height, width) != self.source_shape:
+            self._fit(height, width)
+        cv2.resize(frame, (self.small.shape[1], self.small.shape[0]), dst=self.small, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=self.gray)
+        # Blur away sensor noise and compression artefacts
+        cv2.GaussianBlur(self.gray, (5, 5), 0, dst=self.gray)
+
+        if self.reference is None or now - self.last_run >= self.refresh_interval:
+            changed = True
+        else:
+            cv2.absdiff(self.gray, self.reference, dst=self.diff)
+            cv2.threshold(self.diff, self.threshold, 255, cv2.THRESH_BINARY, dst=self.diff)
+            changed = cv2.countNonZero(self.diff) >= self.min_area * self.diff.size
+
+        if changed:
+            if self.reference is None:
+                self.reference = self.gray.copy()
+            else:
+                np.copyto(self.reference, self.gray)
+            self.last_run = now
+        return changed
+
+    def reset(self):
+        """Make the next frame run the model, e.g. when the last inference didn't complete"""
+        self.reference = None
@@ -0,0 +1,69 @@
+import numpy as np
+
+def xywh2xyxy(boxes):
+    """Convert Nx4 [cx, cy, w, h] boxes to [x1, y1, x2, y2]"""
+    out = np.empty_like(boxes)
+    half_w = boxes[:, 2] / 2
+    half_h = boxes[:, 3] / 2
+    out[:, 0] = boxes[:, 0] - half_w
+    out[:, 1] = boxes[:, 1] - half_h
+    out[:, 2] = boxes[:, 0] + half_w
+    out[:, 3] = boxes[:, 1] + half_h
+    return out
+
+def nms(boxes, scores, iou_threshold):
+    """Greedy non-maximum suppression, returns indices of the kept boxes by descending score"""
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1).clip(0) * (y2 - y1).clip(0)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        # IoU of the best remaining box against all others in one vectorized step
+        w = (np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest])).clip(0)
+        h = (np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest])).clip(0)
+        inter = w * h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+def batched_nms(detections, iou_threshold, max_det=300):
+    """Class-aware NMS over Nx6 [x1, y1, x2, y2, conf, cls] detections.
+
+    Boxes of different classes are offset so they can never overlap, which lets a
+    single NMS pass handle all classes at once.
+    """
+    if len(detections) == 0:
+        return detections
+    max_wh = detections[:, :4].max() + 1
+    offset_boxes = detections[:, :4] + detections[:, 5:6] * max_wh
+    keep = nms(offset_boxes, detections[:, 4], iou_threshold)[:max_det]
+    return detections[keep]
+
+def non_max_suppression(prediction, conf_threshold=0.25, iou_threshold=0.45, max_det=300):
+    """Turn raw YOLOv5 output (B x N x [cx, cy, w, h, obj, cls...]) into per-image Nx6 detections"""
+    output = []
+    for x in prediction:
+        # Objectness filter first, it removes the vast majority of candidates cheaply
+        x = x[x[:, 4] > conf_threshold]
+        if not len(x):
+            output.append(np.zeros((0, 6), dtype=np.float32))
+            continue
+
+        scores = x[:, 5:] * x[:, 4:5]
+        cls = scores.argmax(1)
+        conf = scores[np.arange(len(scores)), cls]
+        mask = conf > conf_threshold
+        if not mask.any():
+            output.append(np.zeros((0, 6), dtype=np.float32))
+            continue
+
+        detections = np.concatenate((
+            xywh2xyxy(x[mask, :4]),
+            conf[mask, None],
+            cls[mask, None].astype(np.float32)
+        ), axis=1).astype(np.float32)
+        output.append(batched_nms(detections, iou_threshold, max_det))
+    return output
@@ -0,0 +1,95 @@
+import cv2
+import numpy as np
+from app_utils.config import config
+
+class Letterbox:
+    """Resizes and pads frames into a reusable model-input buffer and maps boxes back.
+
+    The buffer is only re-initialised when the source frame size changes, so steady-state
+    streaming does a single resize (and channel swap) per frame into preallocated memory.
+    """
+
+    def __init__(self, size=None, color=114):
+        size = size or config['yolo']['model']['image_size']
+        self.width, self.height = int(size[0]), int(size[1])
+        self.color = color
+        self.buffer = np.full((self.height, self.width, 3), color, dtype=np.uint8)
+        self.source_shape = None
+        self.scale = 1.0
+        self.pad_x = 0
+        self.pad_y = 0
+        self.region = self.buffer
+
+    def _fit(self, height, width):
+        """Compute the geometry for a new source frame size"""
+        self.scale = min(self.width / width, self.height / height)
+        new_width = int(round(width * self.scale))
+        new_height = int(round(height * self.scale))
+        self.pad_x = (self.width - new_width) // 2
+        self.pad_y = (self.height - new_height) // 2
+        self.buffer[:] = self.color
+        self.region = self.buffer[self.pad_y:self.pad_y + new_height, self.pad_x:self.pad_x + new_width]
+        self.interpolation = cv2.INTER_AREA if self.scale < 1 else cv2.INTER_LINEAR
+        self.source_shape = (height, width)
+
+    def __call__(self, frame):
+        """Letterbox a BGR frame into the model-input buffer (RGB, as the model expects)"""
+        height, width = frame.shape[:2]
+        if (height, width) != self.source_shape:
+            self._fit(height, width)
+        cv2.resize(frame, (self.region.shape[1], self.region.shape[0]),
+                   dst=self.region, interpolation=self.interpolation)
+        cv2.cvtColor(self.region, cv2.COLOR_BGR2RGB, dst=self.region)
+        return self.buffer
+
+    def unmap(self, detections, scale=1.0):
+        """Map Nx6 [x1, y1, x2, y2, conf, cls] boxes from model-input to source-frame coordinates.
+
+        scale is applied on top, e.g. to land in a downscaled display frame.
+        """
+        if detections is None or len(detections) == 0 or self.source_shape is None:
+            return detections
+        boxes = np.array(detections, dtype=np.float32)
+        boxes[:, 0:4:2] -= self.pad_x
+        boxes[:, 1:4:2] -= self.pad_y
+        boxes[:, :4] /= self.scale
+        height, width = self.source_shape
+        np.clip(boxes[:, 0:4:2], 0, width, out=boxes[:, 0:4:2])
+        np.clip(boxes[:, 1:4:2], 0, height, out=boxes[:, 1:4:2])
+        if scale != 1.0:
+            boxes[:, :4] *= scale
+        return boxes
+
+class DisplayResizer:
+    """Produces the frame that is drawn on and encoded, downscaled to fit the configured frame size.
+
+    With several buffers they are used in turn, so a frame can still be encoding on
+    another thread while the next one is resized.
+    """
+
+    def __init__(self, max_size=None, buffers=1):
+        if max_size is None:
+            encoding = config.get('encoding', {})
+            max_size = (encoding.get('width'), encoding.get('height'))
+        self.max_width, self.max_height = max_size
+        self.buffers = [None] * buffers
+        self.index = 0
+
+    def __call__(self, frame):
+        """Return (display_frame, scale); display_frame is a reusable buffer owned by this resizer"""
+        height, width = frame.shape[:2]
+        scale = 1.0
+        if self.max_width and self.max_height:
+            scale = min(1.0, self.max_width / width, self.max_height / height)
+        size = (int(round(width * scale)), int(round(height * scale)))
+
+        self.index = (self.index + 1) % len(self.buffers)
+        buffer = self.buffers[self.index]
+        if buffer is None or buffer.shape[:2] != (size[1], size[0]):
+            buffer = self.buffers[self.index] = np.empty((size[1], size[0], 3), dtype=np.uint8)
+
+        if scale < 1.0:
+            cv2.resize(frame, size, dst=buffer, interpolation=cv2.INTER_AREA)
+        else:
+            np.copyto(buffer, frame)
+        return buffer, scale
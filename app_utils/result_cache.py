@@ -0,0 +1,139 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from app_utils.config import config
+
+# Rough per-row cost of the key, timestamp and SQLite bookkeeping, counted towards the size limit
+ROW_OVERHEAD = 64
+
+class ResultCache:
+    """Detections of model inputs seen before, kept in SQLite across runs.
+
+    Rows are keyed by a hash of the letterboxed model input together with the model
+    weights, the engine, the thresholds and the input size, so any change to what the
+    model would compute misses the cache. Detections are stored as raw float32 arrays
+    in model-input coordinates. When the database outgrows max_size_mb the least
+    recently used rows are evicted.
+    """
+
+    _fingerprints = {}  # (path, size, mtime) -> sha256 of a weights file
+    _fingerprints_lock = threading.Lock()
+
+    def __init__(self, path=None, max_size_mb=None):
+        cache = config.get('offline', {}).get('cache', {})
+        self.path = path or cache.get('path', os.path.join('results', 'cache.sqlite'))
+        self.max_bytes = (max_size_mb or cache.get('max_size_mb', 1024)) * 1024 * 1024
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        # Autocommit; every write below is its own explicit transaction
+        self.connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS results '
+                                '(key BLOB PRIMARY KEY, detections BLOB NOT NULL, used REAL NOT NULL) WITHOUT ROWID')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+        self.size = self._measure()
+
+    def _measure(self):
+        rows, size = self.connection.execute('SELECT COUNT(*), COALESCE(SUM(LENGTH(detections)), 0) FROM results').fetchone()
+        return size + rows * ROW_OVERHEAD
+
+    @classmethod
+    def fingerprint(cls, path):
+        """sha256 of a weights file, computed once per version of the file"""
+        stat = os.stat(path)
+        version = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with cls._fingerprints_lock:
+            digest = cls._fingerprints.get(version)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    sha.update(chunk)
+            digest = sha.hexdigest()
+            with cls._fingerprints_lock:
+                cls._fingerprints[version] = digest
+        return digest
+
+    @classmethod
+    def context(cls, weights_path, engine=None):
+        """Everything besides the input that decides a model's output, as a key prefix"""
+        yolo = config['yolo']
+        return json.dumps({
+            'weights': cls.fingerprint(weights_path),
+            'engine': engine or yolo.get('engine', 'torch'),
+            'conf': yolo['confidence_threshold'],
+            'iou': yolo['iou_threshold'],
+            'size': list(yolo['model']['image_size'])
+        }, sort_keys=True).encode()
+
+    @staticmethod
+    def key(context, model_input):
+        """Cache key of one model input"""
+        digest = hashlib.blake2b(context, digest_size=20)
+        digest.update(str(model_input.shape).encode())
+        digest.update(np.ascontiguousarray(model_input).data)
+        return digest.digest()
+
+    def get_many(self, keys):
+        """Cached detections by key, for the keys that are present"""
+        if not keys:
+            return {}
+        found = {}
+        with self.lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self.connection.execute(
+                    f"SELECT key, detections FROM results WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                found.update((key, np.frombuffer(blob, dtype=np.float32).reshape(-1, 6)) for key, blob in rows)
+            if found:
+                # Mark as recently used so eviction keeps them
+                now = time.time()
+                self.connection.executemany('UPDATE results SET used = ? WHERE key = ?',
+                                            [(now, key) for key in found])
+        return found
+
+    def put_many(self, entries):
+        """Store (key, detections) pairs, then evict if the cache has grown too large"""
+        if not entries:
+            return
+        now = time.time()
+        rows = [(key, np.asarray(detections, dtype=np.float32).reshape(-1, 6).tobytes(), now)
+                for key, detections in entries]
+        with self.lock:
+            self.connection.execute('BEGIN')
+            self.connection.executemany('INSERT OR REPLACE INTO results (key, detections, used) VALUES (?, ?, ?)', rows)
+            self.connection.execute('COMMIT')
+            self.size += sum(len(blob) + ROW_OVERHEAD for _, blob, _ in rows)
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Delete least recently used rows until the cache is back to 90% of its limit"""
+        # Other processes may share the file, so start from the real size
+        self.size = self._measure()
+        excess = self.size - int(self.max_bytes * 0.9)
+        if excess <= 0:
+            return
+        evicted = []
+        for key, length in self.connection.execute('SELECT key, LENGTH(detections) FROM results ORDER BY used'):
+            evicted.append((key,))
+            excess -= length + ROW_OVERHEAD
+            if excess <= 0:
+                break
+        self.connection.execute('BEGIN')
+        self.connection.executemany('DELETE FROM results WHERE key = ?', evicted)
+        self.connection.execute('COMMIT')
+        self.size = self._measure()
+        logging.info(f"Result cache evicted {len(evicted)} entries, {self.size / 1024 / 1024:.1f} MB left")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,118 @@
+import numpy as np
+from app_utils.config import config
+from app_utils.postprocess import batched_nms
+from app_utils.preprocess import Letterbox
+
+# Used for whatever the 'tiling' section of config.yaml leaves out
+TILING_DEFAULTS = {
+    'enabled': False,
+    'tile_size': 1536,
+    'overlap': 0.2,
+    'full_frame': True
+}
+
+class Tiler:
+    """Splits a frame into overlapping tiles for the model and merges their detections.
+
+    A drop-in for Letterbox on the inference path: calling it returns one model input
+    per tile, to be run as a batch, and unmap takes the per-tile detections back to
+    source-frame coordinates and merges them with class-aware NMS. Each tile has its own
+    Letterbox, so the inputs are reused buffers like the single-frame path.
+
+    The tiles of a frame only run as one batch if they fit in max_tiles (the model's
+    batch size); frames that need more are refused with a ValueError.
+    """
+
+    def __init__(self, tile_size=1536, overlap=0.2, full_frame=True, iou_threshold=None, size=None, max_tiles=None):
+        if isinstance(tile_size, (list, tuple)):
+            self.tile_width, self.tile_height = int(tile_size[0]), int(tile_size[1])
+        else:
+            self.tile_width = self.tile_height = int(tile_size)
+        if not 0 <= overlap < 1:
+            raise ValueError("Tile overlap must be at least 0 and less than 1")
+        self.overlap = overlap
+        self.full_frame = full_frame
+        self.iou_threshold = iou_threshold if iou_threshold is not None else config['yolo']['iou_threshold']
+        self.size = size
+        self.max_tiles = max_tiles
+        self.source_shape = None
+        self.regions = []      # (x1, y1, x2, y2) of each tile in the source frame
+        self.letterboxes = []
+
+    def _starts(self, length, tile):
+        """Tile offsets along one axis; the last tile is aligned with the frame edge"""
+        if length <= tile:
+            return [0]
+        stride = max(1, int(tile * (1 - self.overlap)))
+        return list(range(0, length - tile, stride)) + [length - tile]
+
+    def _regions(self, height, width):
+        regions = [(x, y, min(x + self.tile_width, width), min(y + self.tile_height, height))
+                   for y in self._starts(height, self.tile_height)
+                   for x in self._starts(width, self.tile_width)]
+        if self.full_frame and len(regions) > 1:
+            regions.insert(0, (0, 0, width, height))
+        return regions
+
+    def check(self, height, width):
+        """Number of tiles of a frame this size; ValueError if they don't fit in one batch"""
+        count = len(self._regions(height, width))
+        if self.max_tiles and count > self.max_tiles:
+            raise ValueError(f"A {width}x{height} frame makes {count} tiles, more than the batch size of "
+                             f"{self.max_tiles}; use larger tiles or raise yolo.batching.max_batch_size")
+        return count
+
+    def _fit(self, height, width):
+        self.check(height, width)
+        self.regions = self._regions(height, width)
+        while len(self.letterboxes) < len(self.regions):
+            self.letterboxes.append(Letterbox(self.size))
+        del self.letterboxes[len(self.regions):]
+        self.source_shape = (height, width)
+
+    def __len__(self):
+        return len(self.regions)
+
+    def __call__(self, frame):
+        """Letterbox every tile of a BGR frame, returning one model input per tile"""
+        height, width = frame.shape[:2]
+        if (height, width) != self.source_shape:
+            self._fit(height, width)
+        return [letterbox(frame[y1:y2, x1:x2])
+                for letterbox, (x1, y1, x2, y2) in zip(self.letterboxes, self.regions)]
+
+    def unmap(self, detections, scale=1.0):
+        """Merge per-tile Nx6 detections into one Nx6 array in source-frame coordinates.
+
+        With the full frame as a tile, boxes cut by the inner edge of a tile are dropped:
+        the overlap or the full-frame view has the whole object.
+        """
+        height, width = self.source_shape
+        tiled = self.full_frame and len(self.regions) > 1
+        parts = []
+        for index, (letterbox, region, tile_detections) in enumerate(zip(self.letterboxes, self.regions, detections)):
+            if tile_detections is None or len(tile_detections) == 0:
+                continue
+            boxes = letterbox.unmap(tile_detections)
+            x1, y1, x2, y2 = region
+            if tiled and index > 0:
+                margin = 2
+                cut = np.zeros(len(boxes), dtype=bool)
+                if x1 > 0:
+                    cut |= boxes[:, 0] <= margin
+                if y1 > 0:
+                    cut |= boxes[:, 1] <= margin
+                if x2 < width:
+                    cut |= boxes[:, 2] >= (x2 - x1) - margin
+                if y2 < height:
+                    cut |= boxes[:, 3] >= (y2 - y1) - margin
+                boxes = boxes[~cut]
+            boxes[:, 0:4:2] += x1
+            boxes[:, 1:4:2] += y1
+            parts.append(boxes)
+        if not parts:
+            return np.zeros((0, 6), dtype=np.float32)
+        merged = batched_nms(np.concatenate(parts), self.iou_threshold)
+        if scale != 1.0:
+            merged[:, :4] *= scale
+        return merged
@@ -0,0 +1,27 @@
+import logging
+import time
+from contextlib import contextmanager
+
+class PhaseTimer:
+    """Records how long named startup phases take and logs a one-line breakdown"""
+
+    def __init__(self):
+        self.phases = []  # (name, seconds) in the order they ran
+
+    def add(self, name, seconds):
+        self.phases.append((name, seconds))
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def total(self):
+        return sum(seconds for _, seconds in self.phases)
+
+    def log(self, title='Startup timing'):
+        breakdown = ' | '.join(f"{name} {seconds:.2f}s" for name, seconds in self.phases)
+        logging.info(f"{title}: {breakdown} | total {self.total():.2f}s")
@@ -0,0 +1,127 @@
+import numpy as np
+
+# Used for whatever the 'tracking' section of config.yaml leaves out
+TRACKING_DEFAULTS = {
+    'enabled': False,
+    'detect_every': 5,
+    'detect_interval_ms': 0,
+    'iou_threshold': 0.3,
+    'max_missed': 2,
+    'smoothing': 0.5
+}
+
+def box_iou(a, b):
+    """Pairwise IoU of Nx4 and Mx4 [x1, y1, x2, y2] boxes, as an NxM array"""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-9), 0.0)
+
+class Tracker:
+    """Carries boxes between detection rounds and gives each object a persistent id.
+
+    Detections are matched to the tracks' predicted positions by IoU, greedily and
+    only within the same class. Each track moves at a constant velocity (per box
+    coordinate, in pixels per second) estimated from its last two matches, so boxes
+    can be shown at the camera frame rate while the model runs far less often.
+    Output rows are [x1, y1, x2, y2, conf, cls, track_id].
+    """
+
+    def __init__(self, iou_threshold=0.3, max_missed=2, smoothing=0.5):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.smoothing = smoothing
+        self.boxes = np.zeros((0, 4), dtype=np.float32)     # Position when last matched
+        self.velocity = np.zeros((0, 4), dtype=np.float32)
+        self.seen_at = np.zeros(0)                          # Time of the last match
+        self.scores = np.zeros(0, dtype=np.float32)
+        self.classes = np.zeros(0, dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.missed = np.zeros(0, dtype=np.int32)
+        self.next_id = 1
+
+    def _predicted(self, now):
+        return self.boxes + self.velocity * (now - self.seen_at)[:, None].astype(np.float32)
+
+    def predict(self, now=None):
+        """Tracks seen in the last detection round, moved to where they should be at now.
+
+        Without now, they are returned where they were last detected.
+        """
+        visible = self.missed == 0
+        boxes = self._predicted(now)[visible] if now is not None else self.boxes[visible]
+        return np.column_stack([boxes, self.scores[visible], self.classes[visible],
+                                self.ids[visible]]).astype(np.float32)
+
+    def update(self, detections, now):
+        """Match a detection round (Nx6 [x1, y1, x2, y2, conf, cls]) to the tracks and return the tracked boxes"""
+        detections = np.asarray(detections if detections is not None else [], dtype=np.float32).reshape(-1, 6)
+        matched_tracks, matched_detections = self._match(detections, now)
+
+        # Matched tracks move to their detection and update their velocity
+        if len(matched_tracks):
+            elapsed = (now - self.seen_at[matched_tracks])[:, None]
+            moved = detections[matched_detections, :4] - self.boxes[matched_tracks]
+            measured = np.where(elapsed > 0, moved / np.maximum(elapsed, 1e-6), 0.0)
+            self.velocity[matched_tracks] = (self.smoothing * measured
+                                             + (1 - self.smoothing) * self.velocity[matched_tracks])
+            self.boxes[matched_tracks] = detections[matched_detections, :4]
+            self.seen_at[matched_tracks] = now
+            self.scores[matched_tracks] = detections[matched_detections, 4]
+            self.classes[matched_tracks] = detections[matched_detections, 5]
+
+        # Unmatched tracks coast, and are forgotten after max_missed rounds
+        missed = np.ones(len(self.ids), dtype=bool)
+        missed[matched_tracks] = False
+        self.missed[missed] += 1
+        self.missed[~missed] = 0
+        keep = self.missed <= self.max_missed
+        self._select(keep)
+
+        # Unmatched detections start new tracks
+        new = np.ones(len(detections), dtype=bool)
+        new[matched_detections] = False
+        count = int(new.sum())
+        if count:
+            self.boxes = np.concatenate([self.boxes, detections[new, :4]])
+            self.velocity = np.concatenate([self.velocity, np.zeros((count, 4), dtype=np.float32)])
+            self.seen_at = np.concatenate([self.seen_at, np.full(count, now)])
+            self.scores = np.concatenate([self.scores, detections[new, 4]])
+            self.classes = np.concatenate([self.classes, detections[new, 5]])
+            self.ids = np.concatenate([self.ids, np.arange(self.next_id, self.next_id + count)])
+            self.missed = np.concatenate([self.missed, np.zeros(count, dtype=np.int32)])
+            self.next_id += count
+        return self.predict(now)
+
+    def _match(self, detections, now):
+        """Greedy IoU matching of predicted tracks to detections of the same class"""
+        if not len(self.ids) or not len(detections):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        iou = box_iou(self._predicted(now), detections[:, :4])
+        iou[self.classes[:, None] != detections[None, :, 5]] = 0.0
+        tracks, candidates = np.nonzero(iou >= self.iou_threshold)
+        order = np.argsort(-iou[tracks, candidates], kind='stable')
+        matched_tracks, matched_detections = [], []
+        used_tracks, used_detections = set(), set()
+        for track, detection in zip(tracks[order], candidates[order]):
+            if track in used_tracks or detection in used_detections:
+                continue
+            used_tracks.add(track)
+            used_detections.add(detection)
+            matched_tracks.append(track)
+            matched_detections.append(detection)
+        return np.array(matched_tracks, dtype=np.int64), np.array(matched_detections, dtype=np.int64)
+
+    def _select(self, keep):
+        self.boxes = self.boxes[keep]
+        self.velocity = self.velocity[keep]
+        self.seen_at = self.seen_at[keep]
+        self.scores = self.scores[keep]
+        self.classes = self.classes[keep]
+        self.ids = self.ids[keep]
+        self.missed = self.missed[keep]
@@ -0,0 +1,254 @@
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+import numpy as np
+from app_utils.config import config
+
+def _layout_size(layout):
+    """Bytes needed for the input frames, output boxes and box counts of every slot"""
+    slots, batch, height, width, max_det = layout
+    return slots * batch * (height * width * 3 + max_det * 6 * 4 + 4)
+
+def _views(buffer, layout):
+    """numpy views of a worker's shared memory: inputs, outputs and per-frame box counts"""
+    slots, batch, height, width, max_det = layout
+    offset = 0
+    inputs = np.ndarray((slots, batch, height, width, 3), dtype=np.uint8, buffer=buffer, offset=offset)
+    offset += inputs.nbytes
+    outputs = np.ndarray((slots, batch, max_det, 6), dtype=np.float32, buffer=buffer, offset=offset)
+    offset += outputs.nbytes
+    counts = np.ndarray((slots, batch), dtype=np.int32, buffer=buffer, offset=offset)
+    return inputs, outputs, counts
+
+def _worker_main(worker_id, factory, shm_name, layout, tasks, results, threads):
+    """Worker process: owns one model replica and runs the batches placed in its shared memory slots"""
+    shm = None
+    inputs = outputs = counts = None
+    try:
+        # Any failure from here on is reported, so the pool doesn't wait for a worker that never starts
+        try:
+            import torch
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+        shm = shared_memory.SharedMemory(name=shm_name)
+        inputs, outputs, counts = _views(shm.buf, layout)
+        engine = factory()
+        results.put(('ready', worker_id, None, engine.memory_bytes()))
+        max_det = outputs.shape[2]
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            slot, size = task
+            try:
+                detections = engine([inputs[slot, i] for i in range(size)])
+                for i, det in enumerate(detections):
+                    n = min(len(det), max_det)
+                    outputs[slot, i, :n] = det[:n]
+                    counts[slot, i] = n
+                results.put(('done', worker_id, slot, None))
+            except Exception as e:
+                results.put(('error', worker_id, slot, str(e)))
+    except Exception as e:
+        results.put(('failed', worker_id, None, str(e)))
+    finally:
+        # Views must be gone before the segment can be closed
+        del inputs, outputs, counts
+        if shm is not None:
+            shm.close()
+
+class WorkerPool:
+    """Inference engine backed by worker processes, each owning a model replica.
+
+    Every worker has a shared memory segment with a few batch slots. Frames are copied
+    straight into a free slot and detections are read back from it, so only slot
+    numbers cross the process boundary. Batches go to the worker with the fewest
+    batches in flight, preferring the one that has been finishing them fastest.
+    """
+    name = 'workers'
+
+    def __init__(self, factory, workers=None, slots=None, max_batch_size=None, weights_path=None):
+        # factory is a picklable callable that builds and warms up an engine inside a worker
+        self.weights_path = weights_path  # File the workers' engines run, identifies the model
+        inference = config.get('inference', {})
+        workers = workers or inference.get('workers', 1)
+        slots = slots or inference.get('slots_per_worker', 2)
+        max_batch_size = max_batch_size or config['yolo'].get('batching', {}).get('max_batch_size', 8)
+        self.max_batch_size = max_batch_size  # Largest batch a slot holds
+        width, height = config['yolo']['model']['image_size']
+        self.image_size = (width, height)
+        self.layout = (slots, max_batch_size, height, width, inference.get('max_detections', 300))
+        threads = inference.get('threads_per_worker') or max(1, (os.cpu_count() or 1) // workers)
+
+        context = multiprocessing.get_context('spawn')
+        self.results = context.Queue()
+        self.condition = threading.Condition()
+        self.workers = []
+        self.running = True
+        self.device = f"{workers} worker processes"
+        try:
+            for worker_id in range(workers):
+                shm = shared_memory.SharedMemory(create=True, size=_layout_size(self.layout))
+                tasks = context.Queue()
+                process = context.Process(target=_worker_main,
+                                          args=(worker_id, factory, shm.name, self.layout, tasks, self.results, threads),
+                                          daemon=True)
+                process.start()
+                inputs, outputs, counts = _views(shm.buf, self.layout)
+                self.workers.append({
+                    'id': worker_id,
+                    'process': process,
+                    'tasks': tasks,
+                    'shm': shm,
+                    'inputs': inputs,
+                    'outputs': outputs,
+                    'counts': counts,
+                    'free': list(range(slots)),
+                    'busy': {},             # slot -> (future, started, frame count)
+                    'batch_seconds': 0.0,   # Moving average, breaks ties between equally loaded workers
+                    'alive': True,
+                    'memory': 0
+                })
+            self._wait_ready(inference.get('start_timeout', 300))
+        except Exception:
+            self.close()
+            raise
+
+        self.collector = threading.Thread(target=self._collect)
+        self.collector.daemon = True
+        self.collector.start()
+        logging.info(f"Started {workers} inference workers ({threads} threads each, {slots} slots of {max_batch_size} frames)")
+
+    def _wait_ready(self, timeout):
+        """Block until every worker has loaded its model, failing as soon as one of them dies"""
+        deadline = time.time() + timeout
+        ready = 0
+        while ready < len(self.workers):
+            try:
+                kind, worker_id, _, payload = self.results.get(timeout=min(1.0, max(0.1, deadline - time.time())))
+            except queue.Empty:
+                # A worker killed while loading (out of memory, for one) never reports
+                for worker in self.workers:
+                    if not worker['process'].is_alive():
+                        raise RuntimeError(f"Inference worker {worker['id']} exited with code "
+                                           f"{worker['process'].exitcode} while starting")
+                if time.time() >= deadline:
+                    raise RuntimeError(f"Inference workers did not start within {timeout}s")
+                continue
+            if kind != 'ready':
+                raise RuntimeError(f"Inference worker {worker_id} failed to start: {payload}")
+            self.workers[worker_id]['memory'] = payload
+            ready += 1
+
+    def submit(self, frames):
+        """Copy a batch into a free slot of the least loaded worker and return a Future for its detections.
+
+        Blocks while every slot of every worker is busy.
+        """
+        if len(frames) > self.layout[1]:
+            raise ValueError(f"Batch of {len(frames)} frames exceeds the worker batch size {self.layout[1]}")
+        future = Future()
+        with self.condition:
+            while True:
+                if not self.running:
+                    raise RuntimeError("Inference worker pool is stopped")
+                alive = [worker for worker in self.workers if worker['alive']]
+                if not alive:
+                    raise RuntimeError("All inference workers have exited")
+                candidates = [worker for worker in alive if worker['free']]
+                if candidates:
+                    break
+                self.condition.wait(0.5)
+            worker = min(candidates, key=lambda w: (len(w['busy']), w['batch_seconds']))
+            slot = worker['free'].pop()
+            worker['busy'][slot] = (future, time.perf_counter(), len(frames))
+
+        # The slot is ours until its result is collected, no lock needed to fill it
+        for i, frame in enumerate(frames):
+            np.copyto(worker['inputs'][slot, i], frame)
+        worker['tasks'].put((slot, len(frames)))
+        return future
+
+    def __call__(self, frames):
+        return self.submit(frames).result()
+
+    def _release(self, worker, slot):
+        with self.condition:
+            worker['free'].append(slot)
+            self.condition.notify_all()
+
+    def _collect(self):
+        """Collector thread: copy finished detections out of shared memory and resolve their futures"""
+        while self.running:
+            try:
+                kind, worker_id, slot, payload = self.results.get(timeout=1.0)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            except (EOFError, OSError):
+                break
+
+            worker = self.workers[worker_id]
+            with self.condition:
+                entry = worker['busy'].pop(slot, None)
+            if entry is None:
+                continue
+            future, started, size = entry
+            if kind == 'done':
+                counts = worker['counts'][slot]
+                detections = [worker['outputs'][slot, i, :counts[i]].copy() for i in range(size)]
+                worker['batch_seconds'] = 0.8 * worker['batch_seconds'] + 0.2 * (time.perf_counter() - started)
+                self._release(worker, slot)
+                future.set_result(detections)
+            else:
+                self._release(worker, slot)
+                future.set_exception(RuntimeError(f"Inference worker {worker_id}: {payload}"))
+
+    def _check_workers(self):
+        """Stop dispatching to workers that have died and fail the batches they held"""
+        for worker in self.workers:
+            if not worker['alive'] or worker['process'].is_alive():
+                continue
+            with self.condition:
+                if not self.running:
+                    # Closing: the workers were told to exit
+                    return
+                worker['alive'] = False
+                lost = list(worker['busy'].values())
+                worker['busy'].clear()
+                self.condition.notify_all()
+            logging.error(f"Inference worker {worker['id']} exited with code {worker['process'].exitcode}")
+            for future, _, _ in lost:
+                future.set_exception(RuntimeError(f"Inference worker {worker['id']} exited"))
+
+    def memory_bytes(self):
+        return sum(worker['memory'] for worker in self.workers)
+
+    def warmup(self, runs=None, batch_sizes=None):
+        """Workers warm up their own replicas when they start"""
+
+    def close(self):
+        """Stop the workers and free their shared memory"""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        for worker in self.workers:
+            if worker['process'].is_alive():
+                worker['tasks'].put(None)
+        for worker in self.workers:
+            worker['process'].join(timeout=5)
+            if worker['process'].is_alive():
+                worker['process'].terminate()
+            for future, _, _ in worker['busy'].values():
+                future.cancel()
+            worker['busy'].clear()
+            worker['inputs'] = worker['outputs'] = worker['counts'] = None
+            worker['shm'].close()
+            worker['shm'].unlink()
+        logging.info("Inference workers stopped")
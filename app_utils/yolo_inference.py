@@ -1,23 +1,41 @@
-import torch
+import os
 import cv2
 import numpy as np
-from app_utils.config import config as app_config
+from app_utils.config import config as app_config, source_settings
+from app_utils.engines import load_engine
+from app_utils.preprocess import Letterbox
+from app_utils.tiling import TILING_DEFAULTS, Tiler
 
 class YOLOInference:
-    def __init__(self, model_path):
-        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        self.model = torch.hub.load('ultralytics/yolov5', 'custom', 
-                                  path=model_path, 
-                                  device=self.device)
-        self.model.conf = config['yolo']['confidence_threshold']
-        self.model.iou = config['yolo']['iou_threshold']
+    def __init__(self, model_path, engine_name=None, tiling=None):
+        dataset_path = os.path.dirname(model_path)
+        self.model = load_engine(dataset_path, engine_name or app_config['yolo'].get('engine', 'torch'))
+        self.device = self.model.device
+        # tiling: settings as returned by source_settings('tiling'), the configured ones by default
+        tiling = tiling or source_settings('tiling', None, TILING_DEFAULTS)
+        if tiling['enabled']:
+            # Engines without a batch limit (max_batch_size) take any number of tiles
+            self.letterbox = Tiler(tiling['tile_size'], tiling['overlap'], tiling['full_frame'],
+                                   max_tiles=getattr(self.model, 'max_batch_size', None))
+        else:
+            self.letterbox = Letterbox()
+
+        # Class names come from labels.txt next to the weights
+        self.names = []
+        labels_path = os.path.join(dataset_path, 'labels.txt')
+        if os.path.exists(labels_path):
+            with open(labels_path, 'r') as f:
+                self.names = [line.strip() for line in f if line.strip()]
         
     def process_frame(self, frame):
-        # Run inference
-        results = self.model(frame)
+        # Run inference, on all the tiles at once when tiling
+        if isinstance(self.letterbox, Tiler):
+            detections = self.model(self.letterbox(frame))
+        else:
+            detections = self.model([self.letterbox(frame)])[0]
         
-        # Get detections
-        detections = results.xyxy[0].cpu().numpy()
+        # Get detections in frame coordinates
+        detections = self.letterbox.unmap(detections)
         
         # Draw detections
         annotated_frame = frame.copy()
@@ -30,7 +48,8 @@ class YOLOInference:
             cv2.rectangle(annotated_frame, (x1, y1), (x2, y2), (0, 0, 255), line_thickness)
             
             # Prepare label text
-            label = f"{results.names[int(cls)]} {conf:.2f}"
+            name = self.names[int(cls)] if int(cls) < len(self.names) else str(int(cls))
+            label = f"{name} {conf:.2f}"
             
             # Calculate text size and background
             font = cv2.FONT_HERSHEY_SIMPLEX
@@ -0,0 +1,142 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from app_models._model import Model
+from app_utils.config import config
+from app_utils.engines import load_engine
+from controllers.scheduler import InferenceScheduler
+
+class ModelRegistry:
+    """Loads dataset models on demand and keeps the most recently used ones resident.
+
+    Every resident model has its own InferenceScheduler, so frames are only batched
+    with frames headed for the same model. Models that no stream is using are
+    evicted least recently used first once the memory budget is exceeded.
+    """
+
+    def __init__(self, memory_budget_mb=None):
+        registry = config['yolo'].get('registry', {})
+        self.memory_budget = (memory_budget_mb or registry.get('memory_budget_mb', 2048)) * 1024 * 1024
+        self.models = OrderedDict()  # name -> resident entry, least recently used first
+        self.directories = {}        # name -> dataset directory for models added outside BASE_DIR
+        self.lock = threading.Lock()
+        self.load_locks = {}
+
+    def _insert(self, name, engine, labels, directory, users):
+        entry = {
+            'name': name,
+            'engine': engine,
+            'labels': labels,
+            'directory': directory,
+            'size': engine.memory_bytes(),
+            'scheduler': InferenceScheduler(engine, name=name),
+            'users': users
+        }
+        entry['scheduler'].start()
+        with self.lock:
+            self.models[name] = entry
+            self.models.move_to_end(name)
+        logging.info(f"Model {name} resident ({entry['size'] / 1024 / 1024:.1f} MB)")
+        self._evict(keep=name)
+        return entry
+
+    def add(self, name, engine, labels, directory):
+        """Register a model that has already been loaded"""
+        self.directories[name] = directory
+        return self._insert(name, engine, labels, directory, users=0)
+
+    def _use(self, name):
+        """Mark a resident model as in use, or return None if it isn't resident"""
+        with self.lock:
+            entry = self.models.get(name)
+            if entry is not None:
+                entry['users'] += 1
+                self.models.move_to_end(name)
+            return entry
+
+    def acquire(self, name):
+        """Get a model for a stream, loading it if it isn't resident. Pair with release()."""
+        entry = self._use(name)
+        if entry is not None:
+            return entry
+
+        with self.lock:
+            load_lock = self.load_locks.setdefault(name, threading.Lock())
+        with load_lock:
+            # Another stream may have loaded it while we waited
+            entry = self._use(name)
+            if entry is not None:
+                return entry
+
+            directory = self.directories.get(name)
+            if directory is None:
+                model = Model.get_by_name(name)
+                if model is None:
+                    raise ValueError(f"Model {name} not found in {Model.BASE_DIR}")
+                directory = os.path.join(Model.BASE_DIR, model['directory'])
+                labels = model['labels']
+            else:
+                with open(os.path.join(directory, 'labels.txt'), 'r') as f:
+                    labels = [line.strip() for line in f if line.strip()]
+
+            logging.info(f"Loading model {name} from {directory}")
+            return self._insert(name, load_engine(directory), labels, directory, users=1)
+
+    def release(self, name):
+        """A stream stopped using a model; it becomes eligible for eviction"""
+        with self.lock:
+            entry = self.models.get(name)
+            if entry is not None:
+                entry['users'] = max(0, entry['users'] - 1)
+        self._evict()
+
+    def _evict(self, keep=None):
+        """Drop unused models, least recently used first, until we're within the memory budget"""
+        evicted = []
+        with self.lock:
+            total = sum(entry['size'] for entry in self.models.values())
+            for name in list(self.models.keys()):
+                if total <= self.memory_budget:
+                    break
+                entry = self.models[name]
+                if entry['users'] > 0 or name == keep:
+                    continue
+                del self.models[name]
+                total -= entry['size']
+                evicted.append(entry)
+            if total > self.memory_budget:
+                logging.warning(f"Resident models use {total / 1024 / 1024:.1f} MB, over the "
+                                f"{self.memory_budget / 1024 / 1024:.0f} MB budget, but all are in use")
+
+        for entry in evicted:
+            entry['scheduler'].stop()
+            entry['engine'].close()
+            logging.info(f"Evicted model {entry['name']}")
+
+    def list_models(self):
+        """All available models, flagged with whether they are resident and how many streams use them"""
+        try:
+            scanned = Model.scan_models()
+        except Exception:
+            # The dataset base directory may not exist; still list what is loaded
+            scanned = []
+        models = {model['name']: model for model in scanned}
+        with self.lock:
+            for name in self.directories:
+                models.setdefault(name, {'name': name, 'directory': self.directories[name]})
+            for name, entry in self.models.items():
+                models[name]['labels'] = entry['labels']
+            for name, model in models.items():
+                entry = self.models.get(name)
+                model['resident'] = entry is not None
+                model['users'] = entry['users'] if entry else 0
+        return list(models.values())
+
+    def stop(self):
+        """Stop all schedulers"""
+        with self.lock:
+            entries = list(self.models.values())
+        for entry in entries:
+            entry['scheduler'].stop()
+            entry['engine'].close()
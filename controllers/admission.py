@@ -0,0 +1,178 @@
+import logging
+import threading
+from app_utils.config import source_settings
+
+# Used for whatever the 'admission' section of config.yaml leaves out
+ADMISSION_DEFAULTS = {
+    'enabled': True,
+    'budget': 1.0,
+    'policy': 'downgrade',
+    'default_cost_ms': 50,
+    'priority': 0,
+    'weight': 1.0,
+    'min_fps': 1.0
+}
+
+class ComputeBudget:
+    """Shares a fixed amount of inference time between the live streams.
+
+    The budget is in inference seconds per second: 1.0 keeps one device busy, a pool of
+    worker processes can take one per worker. A stream's demand is its requested rate
+    times its measured cost per frame (the model's recent per-frame batch time, scaled by
+    its tiles and detection interval). Priorities are served strictly in order; streams
+    of the same priority split what is left by weighted max-min fair share, so a stream
+    asking for less than its share gets all of it and the rest is divided among the others.
+
+    A new stream is only admitted if it and every running stream still get at least
+    their minimum rate. With the reject policy, it must also get its full requested rate.
+    Running streams can still fall below their minimum when measured costs go up; they
+    are flagged as short (see stats) rather than stopped.
+    """
+
+    POLICIES = ['downgrade', 'reject']
+
+    def __init__(self, budget=None, policy=None):
+        admission = source_settings('admission', None, ADMISSION_DEFAULTS)
+        self.enabled = admission['enabled']
+        self.budget = budget or admission['budget']
+        self.policy = policy or admission['policy']
+        if self.policy not in self.POLICIES:
+            raise ValueError(f"Admission policy must be one of {self.POLICIES}")
+        self.default_cost = admission['default_cost_ms'] / 1000.0
+        self.streams = {}  # source_id -> demand: requested, scheduler, frames, priority, weight, min_fps
+        self.granted = {}  # source_id -> frames per second the stream may process
+        self.short = set()  # Streams granted less than their minimum rate
+        self.lock = threading.Lock()
+
+    def _cost(self, stream):
+        """Inference seconds one processed frame of a stream takes"""
+        frame_seconds = getattr(stream['scheduler'], 'frame_seconds', None) or self.default_cost
+        return frame_seconds * stream['frames']
+
+    def _allocate(self, streams):
+        """Rates for every stream: strict priority, weighted max-min fair share within a priority"""
+        if not self.enabled:
+            return {source_id: stream['requested'] for source_id, stream in streams.items()}
+        rates = {}
+        remaining = self.budget
+        for priority in sorted({stream['priority'] for stream in streams.values()}, reverse=True):
+            active = {source_id: stream for source_id, stream in streams.items() if stream['priority'] == priority}
+            demand = {source_id: stream['requested'] * self._cost(stream) for source_id, stream in active.items()}
+            given = {}
+            # Water-filling: streams that need less than their share are satisfied, the rest
+            # split what remains in proportion to their weights
+            while active:
+                share = remaining / sum(stream['weight'] for stream in active.values())
+                satisfied = [source_id for source_id, stream in active.items()
+                             if demand[source_id] <= share * stream['weight']]
+                if not satisfied:
+                    for source_id, stream in active.items():
+                        given[source_id] = share * stream['weight']
+                    remaining = 0.0
+                    break
+                for source_id in satisfied:
+                    given[source_id] = demand[source_id]
+                    remaining -= demand[source_id]
+                    del active[source_id]
+            for source_id, seconds in given.items():
+                cost = self._cost(streams[source_id])
+                rate = seconds / cost if cost > 0 else streams[source_id]['requested']
+                rates[source_id] = min(streams[source_id]['requested'], rate)
+        return rates
+
+    def admit(self, source_id, requested_fps, scheduler, frames=1.0, settings=None):
+        """Try to fit a new stream into the budget.
+
+        Returns (granted_fps, changed) where changed maps every stream whose rate moved to
+        its new rate, or (None, reason) if the stream can't be served.
+        """
+        settings = settings or source_settings('admission', None, ADMISSION_DEFAULTS)
+        stream = {
+            'requested': float(requested_fps),
+            'scheduler': scheduler,
+            'frames': frames,
+            'priority': settings['priority'],
+            'weight': max(float(settings['weight']), 1e-6),
+            'min_fps': min(float(settings['min_fps']), float(requested_fps))
+        }
+        with self.lock:
+            candidate = {**self.streams, source_id: stream}
+            rates = self._allocate(candidate)
+            granted = rates[source_id]
+            if granted < stream['min_fps'] - 1e-6:
+                return None, f"only {granted:.1f} FPS of compute left, at least {stream['min_fps']:.1f} needed"
+            if self.policy == 'reject' and granted < stream['requested'] - 1e-6:
+                return None, f"only {granted:.1f} of the requested {stream['requested']:.1f} FPS available"
+            squeezed = [other for other, rate in rates.items()
+                        if other != source_id and rate < candidate[other]['min_fps'] - 1e-6]
+            if squeezed:
+                return None, f"would push {len(squeezed)} running stream(s) below their minimum rate"
+            self.streams = candidate
+            return granted, self._apply(rates)
+
+    def update(self, source_id, scheduler=None, frames=None):
+        """Re-run the allocation with the latest measured costs, after a stream switched models or
+        changed its inference frames per processed frame. Returns the streams whose rate moved
+        or that fell below their minimum rate.
+        """
+        with self.lock:
+            stream = self.streams.get(source_id)
+            if stream is None:
+                return {}
+            if scheduler is not None:
+                stream['scheduler'] = scheduler
+            if frames is not None:
+                stream['frames'] = frames
+            return self._apply(self._allocate(self.streams))
+
+    def release(self, source_id):
+        """Hand a stopped stream's share back to the others; returns the streams whose rate moved"""
+        with self.lock:
+            if self.streams.pop(source_id, None) is None:
+                return {}
+            self.granted.pop(source_id, None)
+            self.short.discard(source_id)
+            return self._apply(self._allocate(self.streams))
+
+    def _apply(self, rates):
+        """Store new rates, returning those that changed noticeably or newly fell short of their minimum"""
+        changed = {}
+        for source_id, rate in rates.items():
+            rate = max(0.1, round(rate, 1))  # Streams are never paused outright
+            previous = self.granted.get(source_id)
+            if previous is None or abs(previous - rate) >= 0.1:
+                changed[source_id] = rate
+            self.granted[source_id] = rate
+        if changed:
+            logging.info(f"Compute budget allocation: {self.granted}")
+
+        # Admission keeps every stream at its minimum, but a stream's measured cost can grow
+        # afterwards (a slower model, more tiles than estimated); report it instead of hiding it
+        short = {source_id for source_id, rate in rates.items() if rate < self.streams[source_id]['min_fps'] - 1e-6}
+        for source_id in short - self.short:
+            logging.warning(f"Stream {source_id} gets {self.granted[source_id]:.1f} FPS, below its minimum of "
+                            f"{self.streams[source_id]['min_fps']:.1f}")
+            changed[source_id] = self.granted[source_id]
+        for source_id in self.short - short:
+            changed[source_id] = self.granted[source_id]
+        self.short = short
+        return changed
+
+    def rate(self, source_id):
+        """Frames per second a stream may process, None if it isn't budgeted"""
+        return self.granted.get(source_id)
+
+    def stats(self, source_id):
+        with self.lock:
+            stream = self.streams.get(source_id)
+            if stream is None:
+                return None
+            return {
+                'sourceId': source_id,
+                'requestedFps': stream['requested'],
+                'grantedFps': self.granted.get(source_id),
+                'minFps': stream['min_fps'],
+                'belowMinimum': source_id in self.short,
+                'priority': stream['priority'],
+                'costMs': round(self._cost(stream) * 1000, 1)
+            }
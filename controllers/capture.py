@@ -0,0 +1,177 @@
+import cv2
+import logging
+import threading
+from app_utils.config import config
+from app_utils.metrics import frames_captured, frames_dropped, stream_errors
+from controllers.frame_buffer import FrameRing
+
+class SharedCapture:
+    """One connection and decoder for a camera, feeding a FrameRing read by any number of consumers.
+
+    Consumers wait on frames for the newest frame and release it when done, exactly as
+    with a private capture. Metrics are labelled with the source that opened the camera.
+    """
+
+    def __init__(self, url, source_id):
+        self.url = url
+        self.source_id = source_id
+        self.capture = None
+        self.frame_size = None  # (width, height) as reported by the backend, None if unknown
+        self.frames = FrameRing()
+        self.users = 0
+        self.running = False
+        self.thread = None
+
+    def open(self):
+        """Connect to the camera and start decoding, returning False if it can't be opened"""
+        capture = cv2.VideoCapture(self.url)
+        if not capture.isOpened():
+            logging.error("Failed to open RTSP stream")
+            return False
+
+        # Keep the decoder queue short so we always see the newest frame
+        buffer_size = config['rtsp'].get('buffer_size')
+        if buffer_size and not capture.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size):
+            logging.warning(f"Capture backend ignored buffer size {buffer_size} for source {self.source_id}")
+
+        width, height = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if width > 0 and height > 0:
+            self.frame_size = (width, height)
+
+        self.capture = capture
+        self.running = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        logging.info(f"Capture thread started for source {self.source_id}")
+        return True
+
+    def close(self):
+        """Stop decoding and disconnect; consumers still waiting are released"""
+        self.running = False
+        self.frames.close()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+        try:
+            if self.capture is not None:
+                self.capture.release()
+        except Exception as e:
+            logging.error(f"Error releasing capture: {str(e)}")
+
+    def _run(self):
+        """Capture thread: decode frames into the ring, only while some consumer is waiting when decode_on_demand"""
+        decode_on_demand = config['rtsp'].get('decode_on_demand', True)
+        frames = self.frames
+        source_id = self.source_id
+        try:
+            self._decode(frames, source_id, decode_on_demand)
+        finally:
+            # A dead capture must not be handed to new consumers
+            self.running = False
+            # Wake the consumers so they notice the capture has ended
+            frames.close()
+            logging.info(f"Capture thread stopped for source {source_id}")
+
+    def alive(self):
+        """Whether the capture is still decoding frames"""
+        return self.running and self.thread is not None and self.thread.is_alive() and not self.frames.closed
+
+    def _decode(self, frames, source_id, decode_on_demand):
+        while self.running:
+            try:
+                if decode_on_demand:
+                    # Drain the stream without decoding, only decode frames someone is waiting for
+                    if not self.capture.grab():
+                        logging.error(f"Failed to grab frame from source {source_id}")
+                        stream_errors.inc(source=source_id, stage='capture')
+                        break
+                    if not frames.wanted():
+                        continue
+                    slot, buffer = frames.writable()
+                    if slot is None:
+                        frames_dropped.inc(source=source_id, reason='ring_full')
+                        continue
+                    ret, frame = self.capture.retrieve(buffer)
+                else:
+                    slot, buffer = frames.writable()
+                    if slot is None:
+                        # Every buffer is still in use; skip this frame without decoding it
+                        self.capture.grab()
+                        frames_dropped.inc(source=source_id, reason='ring_full')
+                        continue
+                    ret, frame = self.capture.read(buffer)
+                if ret:
+                    # Decoded into the slot's buffer, no per-frame allocation
+                    frames.commit(slot, frame)
+                    frames_captured.inc(source=source_id)
+                else:
+                    frames.abandon(slot)
+                    logging.error(f"Failed to read frame from source {source_id}")
+                    stream_errors.inc(source=source_id, stage='capture')
+                    break
+            except Exception as e:
+                logging.error(f"Error capturing frame: {str(e)}")
+                stream_errors.inc(source=source_id, stage='capture')
+                break
+
+class CaptureManager:
+    """Reference-counted captures, one per camera URL.
+
+    Every stream of the same camera shares one RTSP session and one decoder, whatever
+    model or frame rate each uses. The connection is closed when the last consumer
+    releases it. Cameras often allow only a few concurrent sessions, and each extra
+    session would decode the same frames again.
+    """
+
+    def __init__(self):
+        self.captures = {}  # url -> SharedCapture
+        self.lock = threading.Lock()
+        self.open_locks = {}
+
+    def acquire(self, url, source_id):
+        """Get the shared capture of a camera, connecting on first use. Pair with release().
+
+        Returns None if the camera can't be opened.
+        """
+        with self.lock:
+            open_lock = self.open_locks.setdefault(url, threading.Lock())
+        # Opening a connection takes seconds; only consumers of the same camera wait for it
+        with open_lock:
+            with self.lock:
+                shared = self.captures.get(url)
+                # A capture whose camera dropped out is replaced by a new connection
+                if shared is not None and shared.alive():
+                    self._add_user(shared)
+                    return shared
+
+            shared = SharedCapture(url, source_id)
+            if not shared.open():
+                return None
+            with self.lock:
+                self.captures[url] = shared
+                self._add_user(shared)
+            return shared
+
+    def _add_user(self, shared):
+        shared.users += 1
+        # Every consumer can hold a frame while the latest one and the one being decoded are in the ring
+        shared.frames.grow(shared.users + 2)
+
+    def release(self, shared):
+        """A consumer is done with a capture; the last one out closes it"""
+        with self.lock:
+            shared.users -= 1
+            if shared.users > 0:
+                return
+            if self.captures.get(shared.url) is shared:
+                del self.captures[shared.url]
+        shared.close()
+        logging.info(f"Camera connection for source {shared.source_id} closed")
+
+    def stop(self):
+        """Close every capture regardless of consumers"""
+        with self.lock:
+            captures = list(self.captures.values())
+            self.captures.clear()
+        for shared in captures:
+            shared.close()
@@ -0,0 +1,125 @@
+import threading
+import time
+from collections import deque
+from app_utils.config import config
+
+class ClientFlow:
+    """Flow control for the frames sent to one client watching one source.
+
+    Frames are only sent while the client has fewer than max_outstanding un-acked
+    frames; otherwise they are dropped for this client instead of being queued in
+    the Socket.IO buffers. The frame rate and JPEG quality adapt to the rate at
+    which the client actually acknowledges frames.
+    """
+
+    MODES = ['overlay', 'detections']
+
+    def __init__(self, sid, frame_rate, mode='overlay', max_quality=None):
+        streaming = config.get('streaming', {})
+        if mode not in self.MODES:
+            raise ValueError(f"Mode must be one of {self.MODES}")
+        self.sid = sid
+        self.mode = mode  # overlay: frames drawn on the server, detections: boxes drawn by the browser
+        self.requested_fps = float(frame_rate)
+        self.keyframe_interval = streaming.get('keyframe_interval', 2.0)
+        self.last_keyframe = 0.0
+        self.max_outstanding = streaming.get('max_outstanding_frames', 2)
+        self.ack_timeout = streaming.get('ack_timeout', 2.0)
+        self.max_quality = max_quality or config.get('encoding', {}).get('quality', 80)
+        self.min_quality = streaming.get('min_jpeg_quality', 40)
+        self.min_fps = streaming.get('min_fps', 0.5)
+        self.window = streaming.get('stats_window', 2.0)
+        self.quality = self.max_quality
+        self.pending = deque()  # Send times of un-acked frames
+        self.acks = deque()     # Ack times within the stats window
+        self.last_sent = 0.0
+        self.last_drop = 0.0
+        self.last_raise = 0.0
+        self.sent = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def _expire(self, now):
+        """Forget frames the client never acknowledged and acks outside the window"""
+        while self.pending and now - self.pending[0] > self.ack_timeout:
+            self.pending.popleft()
+        while self.acks and now - self.acks[0] > self.window:
+            self.acks.popleft()
+
+    def achieved_fps(self, now=None):
+        """Frames per second the client has acknowledged over the stats window"""
+        now = now or time.time()
+        with self.lock:
+            self._expire(now)
+            return len(self.acks) / self.window
+
+    def effective_fps(self, now=None):
+        """Rate we currently send at: the requested rate, throttled while the client is congested"""
+        now = now or time.time()
+        if now - self.last_drop > self.window:
+            return self.requested_fps
+        # Allow some headroom over the consumed rate so we can probe back up
+        achieved = self.achieved_fps(now)
+        return max(self.min_fps, min(self.requested_fps, achieved * 1.25))
+
+    def ready(self, now):
+        """Decide whether the next frame should be sent to this client"""
+        interval = 1.0 / self.effective_fps(now)
+        with self.lock:
+            self._expire(now)
+            # Small tolerance so pacing jitter doesn't halve the rate
+            if now - self.last_sent < interval * 0.9:
+                return False
+            if len(self.pending) >= self.max_outstanding:
+                # Client hasn't caught up: drop rather than queue, and lower the quality
+                self.dropped += 1
+                self.last_drop = now
+                self.quality = max(self.min_quality, self.quality - 5)
+                return False
+            return True
+
+    def keyframe_due(self, now):
+        """In detections mode, whether the next message should carry a fresh keyframe"""
+        with self.lock:
+            if now - self.last_keyframe < self.keyframe_interval:
+                return False
+            self.last_keyframe = now
+            return True
+
+    def on_sent(self, now):
+        with self.lock:
+            self.pending.append(now)
+            self.last_sent = now
+            self.sent += 1
+
+    def abandon(self):
+        """Forget a frame that was counted as sent but never went out"""
+        with self.lock:
+            if self.pending:
+                self.pending.pop()
+
+    def ack(self, *args):
+        """Socket.IO callback invoked when the client has rendered a frame"""
+        now = time.time()
+        with self.lock:
+            if self.pending:
+                self.pending.popleft()
+            self.acks.append(now)
+            # Recover quality one step per window while the client keeps up
+            if (not self.pending and now - self.last_drop > self.window
+                    and now - self.last_raise > self.window):
+                self.quality = min(self.max_quality, self.quality + 5)
+                self.last_raise = now
+
+    def stats(self, source_id):
+        now = time.time()
+        return {
+            'sourceId': source_id,
+            'mode': self.mode,
+            'requestedFps': self.requested_fps,
+            'effectiveFps': round(self.effective_fps(now), 2),
+            'achievedFps': round(self.achieved_fps(now), 2),
+            'quality': self.quality,
+            'sent': self.sent,
+            'dropped': self.dropped
+        }
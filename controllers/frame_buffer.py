@@ -0,0 +1,121 @@
+import threading
+import time
+from app_utils.config import config
+
+class LatestFrame:
+    """Single-slot hand-off of the most recent frame from a capture thread to its consumers"""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.frame = None
+        self.sequence = 0
+        self.timestamp = 0.0
+        self.closed = False
+        self.waiting = 0  # Consumers currently blocked in wait()
+
+    def publish(self, frame):
+        """Replace the current frame and wake up anyone waiting for a new one"""
+        with self.condition:
+            self.frame = frame
+            self.sequence += 1
+            self.timestamp = time.time()
+            self.condition.notify_all()
+            return self.sequence
+
+    def wait(self, last_sequence, timeout=None):
+        """Block until a frame newer than last_sequence is published.
+
+        Returns (sequence, frame, timestamp), or None on timeout or when the buffer is closed.
+        """
+        with self.condition:
+            self.waiting += 1
+            try:
+                ready = self.condition.wait_for(
+                    lambda: self.closed or self.sequence > last_sequence,
+                    timeout
+                )
+            finally:
+                self.waiting -= 1
+            if not ready or self.closed:
+                return None
+            return self._hand_out()
+
+    def _hand_out(self):
+        """The latest (sequence, frame, timestamp), called with the condition held"""
+        return self.sequence, self.frame, self.timestamp
+
+    def release(self, frame):
+        """A consumer is done with a frame returned by wait()"""
+
+    def wanted(self):
+        """True when a consumer is waiting, i.e. the producer should decode the next frame"""
+        return self.waiting > 0
+
+    def close(self):
+        """Release all waiters; no further frames will be delivered"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+class FrameRing(LatestFrame):
+    """Latest-frame hand-off over a fixed ring of reference-counted frame buffers.
+
+    The capture thread decodes straight into a free slot and commits it as the latest
+    frame. The latest slot and every slot handed to a consumer hold a reference, and a
+    slot is decoded into again once its references are released. Buffers are allocated
+    on the first frame (or when the frame size changes), so steady-state capture
+    allocates nothing.
+    """
+
+    def __init__(self, slots=None):
+        super().__init__()
+        slots = slots or config['rtsp'].get('ring_slots', 4)
+        self.buffers = [None] * slots
+        self.refs = [0] * slots
+        self.slot = None  # Slot holding the latest frame
+
+    def grow(self, slots):
+        """Make sure the ring has at least this many slots, e.g. when another consumer joins"""
+        with self.condition:
+            while len(self.buffers) < slots:
+                self.buffers.append(None)
+                self.refs.append(0)
+
+    def writable(self):
+        """Reserve a free slot to decode into, returning (slot, buffer), or (None, None) if all are in use.
+
+        buffer is None until the slot has held a frame; pass it to read()/retrieve() as the
+        destination and commit() whatever array they return.
+        """
+        with self.condition:
+            for slot, refs in enumerate(self.refs):
+                if refs == 0:
+                    self.refs[slot] = 1  # Held by the writer until committed
+                    return slot, self.buffers[slot]
+            return None, None
+
+    def commit(self, slot, frame):
+        """Make a decoded slot the latest frame, recycling the slot it replaces once no consumer holds it"""
+        with self.condition:
+            self.buffers[slot] = frame  # Adopt the array if the decoder had to reallocate it
+            if self.slot is not None:
+                self.refs[self.slot] -= 1
+            self.slot = slot  # The writer's reference becomes the latest frame's
+            # The condition's lock is reentrant, so slot and frame change together
+            return self.publish(frame)
+
+    def abandon(self, slot):
+        """Give back a slot whose decode failed"""
+        with self.condition:
+            self.refs[slot] -= 1
+
+    def _hand_out(self):
+        self.refs[self.slot] += 1
+        return super()._hand_out()
+
+    def release(self, frame):
+        with self.condition:
+            for slot, buffer in enumerate(self.buffers):
+                if buffer is frame:
+                    self.refs[slot] -= 1
+                    return
@@ -0,0 +1,488 @@
+import bisect
+import cv2
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor, wait
+from queue import Empty, Full, Queue
+from app_models.detection import Detection
+from app_utils.config import config
+from app_utils.metrics import (frames_captured, frames_dropped, frames_processed, result_cache_lookups,
+                               stage_seconds, stream_errors)
+from app_utils.preprocess import Letterbox, DisplayResizer
+from app_utils.result_cache import ResultCache
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+class ResultStore:
+    """Appends per-item results to a JSON lines file and keeps a resume checkpoint next to it"""
+
+    def __init__(self, source_id):
+        directory = config.get('offline', {}).get('results_dir', 'results')
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{source_id}.jsonl")
+        self.checkpoint_path = os.path.join(directory, f"{source_id}.checkpoint.json")
+        self.file = None
+
+    def load_checkpoint(self):
+        """Position of the last run, or None if there is nothing to resume"""
+        try:
+            with open(self.checkpoint_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable checkpoint {self.checkpoint_path}: {str(e)}")
+            return None
+
+    def reset(self):
+        """Start over: forget the previous results and checkpoint"""
+        for path in (self.path, self.checkpoint_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def write(self, records, checkpoint):
+        """Append results, then move the checkpoint past them (unless checkpoint is None).
+
+        Results are flushed before the checkpoint is replaced, so an interrupted run
+        may repeat results but never skips one.
+        """
+        if self.file is None:
+            self.file = open(self.path, 'a')
+        for record in records:
+            self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+        if checkpoint is None:
+            return
+        temporary = self.checkpoint_path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(temporary, self.checkpoint_path)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+class OfflineJob:
+    """Runs a recorded source through a model as fast as the pipeline allows.
+
+    Subclasses yield decoded, letterboxed items in order. Items are submitted to the
+    model's scheduler a batch at a time with the next batch already queued, so decoding,
+    inference and result handling overlap. Memory is bounded by the prefetch depth and
+    batch size, not by the size of the source.
+    """
+    type = None
+
+    def __init__(self, controller, source_id, source, model):
+        offline = config.get('offline', {})
+        self.controller = controller
+        self.source_id = source_id
+        self.source = source
+        self.model = model  # Registry entry: engine, labels and scheduler
+        self.batch_size = offline.get('batch_size') or model['scheduler'].max_batch_size
+        self.progress_interval = offline.get('progress_interval', 1.0)
+        self.store = ResultStore(source_id)
+        self.cache = None
+        self.cache_context = None
+        self.checkpoint = None
+        self.running = False
+        self.thread = None
+        self.total = 0
+        self.processed = 0
+        self.failed = 0
+        self.cached = 0
+        self.gap = False  # An item was dropped, so the checkpoint must not move past it
+        self.started_at = None
+
+    def start(self):
+        """Start the job, resuming an interrupted run of the same source"""
+        self.checkpoint = self.store.load_checkpoint()
+        if self.checkpoint and self.checkpoint.get('complete'):
+            self.store.reset()
+            self.checkpoint = None
+        if self.checkpoint:
+            self.processed = self.checkpoint.get('processed', 0)
+            logging.info(f"Resuming {self.type} source {self.source_id} after {self.checkpoint.get('last')}")
+
+        self.running = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        logging.info(f"{self.type.capitalize()} job started for source {self.source_id}")
+
+    def stop(self, timeout=5.0):
+        """Stop after the batches already submitted have been stored"""
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+    def items(self):
+        """Yield (key, frame, letterbox, model_input) tuples in processing order"""
+        raise NotImplementedError
+
+    def describe(self, key):
+        """Fields identifying an item in its result record"""
+        return {'item': key}
+
+    def _open_cache(self):
+        """Open the result cache, or leave it off if it is disabled or the model can't be identified"""
+        if not config.get('offline', {}).get('cache', {}).get('enabled', True):
+            return
+        weights_path = getattr(self.model['engine'], 'weights_path', None)
+        if not weights_path or not os.path.exists(weights_path):
+            logging.info(f"No weights file to identify model {self.model['name']}, result cache not used")
+            return
+        try:
+            self.cache_context = ResultCache.context(weights_path)
+            self.cache = ResultCache()
+        except Exception as e:
+            logging.warning(f"Result cache unavailable: {str(e)}")
+            self.cache = None
+
+    def _submit(self, batch, sequence):
+        """Queue a batch with the model's scheduler; keys are unique so none replaces another.
+
+        Items found in the result cache get an already completed future instead. Returns
+        the cache keys of the items that were sent to the model, to store their results.
+        """
+        scheduler = self.model['scheduler']
+        cache_keys = [None] * len(batch)
+        cached = {}
+        if self.cache is not None:
+            cache_keys = [ResultCache.key(self.cache_context, item[3]) for item in batch]
+            cached = self.cache.get_many(cache_keys)
+        futures = []
+        for i, item in enumerate(batch):
+            if cache_keys[i] in cached:
+                future = Future()
+                future.set_result(cached[cache_keys[i]])
+                cache_keys[i] = None
+                self.cached += 1
+                result_cache_lookups.inc(result='hit')
+            else:
+                future = scheduler.submit(f"{self.source_id}:{sequence + i}", item[3], background=True)
+                if self.cache is not None:
+                    result_cache_lookups.inc(result='miss')
+            futures.append(future)
+        return batch, futures, cache_keys
+
+    def _complete(self, batch, futures, cache_keys):
+        """Wait for a batch, store its results and stream them to the source's viewers"""
+        labels = self.model['labels']
+        records = []
+        checkpoint = None
+        computed = []  # (cache key, detections) of the items the model ran on
+        shown = None
+        for (key, frame, letterbox, _), future, cache_key in zip(batch, futures, cache_keys):
+            try:
+                detections = future.result()
+            except CancelledError:
+                frames_dropped.inc(source=self.source_id, reason='cancelled')
+                self.gap = True
+                continue
+            if cache_key is not None:
+                computed.append((cache_key, detections))
+            boxes = letterbox.unmap(detections)
+            record = self.describe(key)
+            record['detections'] = [{
+                'label': labels[int(cls_id)] if int(cls_id) < len(labels) else str(int(cls_id)),
+                'confidence': round(float(conf), 4),
+                'box': [round(float(v), 1) for v in (x1, y1, x2, y2)]
+            } for x1, y1, x2, y2, conf, cls_id in (boxes if boxes is not None else [])]
+            records.append(record)
+            shown = (frame, boxes)
+            if self.controller.detection_writer is not None:
+                # Jobs can afford to wait for the writer, dropping would leave gaps in the history
+                if not self.controller.detection_writer.add(Detection(self.source_id, self.model['name'], boxes, labels,
+                                                                      frame=key), wait=True):
+                    # The writer has stopped: a resumed run stores this item again
+                    logging.warning(f"Detection history for {key} of source {self.source_id} not stored")
+                    self.gap = True
+            if not self.gap:
+                checkpoint = {'last': key, 'processed': self.processed + len(records)}
+
+        if computed:
+            try:
+                self.cache.put_many(computed)
+            except Exception as e:
+                logging.warning(f"Error storing results in the cache: {str(e)}")
+
+        self.processed += len(records)
+        self.store.write(records, checkpoint)
+        frames_processed.inc(len(records), source=self.source_id)
+        if records:
+            self.controller.socketio.emit('offlineResults', {
+                'sourceId': self.source_id,
+                'results': records
+            }, to=self.controller.room(self.source_id))
+        if shown is not None:
+            self._preview(*shown)
+
+    def _preview(self, frame, boxes):
+        """Show the last image of a batch to viewers that can take a frame"""
+        if not self.controller._flows(self.source_id):
+            return
+        display_frame, scale = self.display(frame)
+        labels = self.model['labels']
+        for x1, y1, x2, y2, conf, cls_id in (boxes if boxes is not None else []):
+            if cls_id < len(labels):
+                label = f"{labels[int(cls_id)]} {conf:.2f}"
+                self.controller._draw_detection(display_frame, int(x1 * scale), int(y1 * scale),
+                                                int(x2 * scale), int(y2 * scale), label)
+        # The display buffer is reused by the next preview, so let the encodes finish
+        wait(self.controller._emit_frame(self.source_id, display_frame))
+
+    def progress(self, complete=False):
+        """Progress and throughput of this run"""
+        elapsed = time.time() - self.started_at if self.started_at else 0.0
+        done = self.processed - (self.checkpoint.get('processed', 0) if self.checkpoint else 0)
+        return {
+            'sourceId': self.source_id,
+            'type': self.type,
+            'processed': self.processed,
+            'total': self.total,
+            'failed': self.failed,
+            'cached': self.cached,
+            'fps': round(done / elapsed, 1) if elapsed > 0 else 0.0,
+            'elapsed': round(elapsed, 1),
+            'complete': complete
+        }
+
+    def _emit_progress(self, complete=False):
+        self.controller.socketio.emit('offlineProgress', self.progress(complete),
+                                      to=self.controller.room(self.source_id))
+
+    def _run(self):
+        self.started_at = time.time()
+        self._open_cache()
+        encoding = self.controller.encoding(self.source_id)
+        self.display = DisplayResizer((encoding['width'], encoding['height']))
+        next_progress = self.started_at + self.progress_interval
+        in_flight = deque()  # Submitted batches, at most two
+        batch = []
+        sequence = 0
+        complete = False
+        try:
+            for item in self.items():
+                if not self.running:
+                    break
+                batch.append(item)
+                if len(batch) < self.batch_size:
+                    continue
+                in_flight.append(self._submit(batch, sequence))
+                sequence += len(batch)
+                batch = []
+                if len(in_flight) > 1:
+                    self._complete(*in_flight.popleft())
+                if time.time() >= next_progress:
+                    self._emit_progress()
+                    next_progress = time.time() + self.progress_interval
+            else:
+                if batch:
+                    in_flight.append(self._submit(batch, sequence))
+                complete = self.running
+
+            while in_flight:
+                self._complete(*in_flight.popleft())
+            # A dropped item has to be picked up by the next run
+            complete = complete and not self.gap
+            if complete:
+                self.store.write([], {'processed': self.processed, 'complete': True})
+                logging.info(f"{self.type.capitalize()} source {self.source_id} done: "
+                             f"{self.processed} processed, {self.failed} failed")
+        except Exception as e:
+            logging.error(f"Error processing {self.type} source {self.source_id}: {str(e)}")
+            logging.exception("Full traceback:")
+            stream_errors.inc(source=self.source_id, stage='process')
+        finally:
+            self.running = False
+            self.store.close()
+            if self.cache is not None:
+                self.cache.close()
+            self._emit_progress(complete)
+            self.controller._job_finished(self.source_id, self)
+
+class DirectoryJob(OfflineJob):
+    """Every image in a directory, in file name order, decoded ahead of inference on a thread pool"""
+    type = 'directory'
+
+    def __init__(self, controller, source_id, source, model):
+        super().__init__(controller, source_id, source, model)
+        offline = config.get('offline', {})
+        self.path = source['connectionDetails']['path']
+        if not os.path.isdir(self.path):
+            raise ValueError(f"Directory not found: {self.path}")
+        self.workers = offline.get('decode_workers', 4)
+        self.prefetch = offline.get('prefetch', 64)
+        self.extensions = tuple(ext.lower() for ext in offline.get('extensions', IMAGE_EXTENSIONS))
+
+    def describe(self, key):
+        return {'file': key}
+
+    def _files(self):
+        """Image file names in processing order, skipping those done before a resume"""
+        with os.scandir(self.path) as entries:
+            names = sorted(entry.name for entry in entries
+                           if entry.is_file() and entry.name.lower().endswith(self.extensions))
+        last = self.checkpoint.get('last') if self.checkpoint else None
+        if last is not None:
+            names = names[bisect.bisect_right(names, last):]
+        return names
+
+    def _load(self, name):
+        """Decode and letterbox one image; runs on the decode pool"""
+        started = time.perf_counter()
+        frame = cv2.imread(os.path.join(self.path, name), cv2.IMREAD_COLOR)
+        if frame is None:
+            return None
+        letterbox = Letterbox()
+        model_input = letterbox(frame)
+        stage_seconds.observe(time.perf_counter() - started, source=self.source_id, stage='preprocess')
+        return name, frame, letterbox, model_input
+
+    def items(self):
+        names = self._files()
+        self.total = self.processed + len(names)
+        remaining = iter(names)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            try:
+                # Keep a fixed number of images decoding ahead of the consumer
+                for name in itertools.islice(remaining, self.prefetch):
+                    pending.append((name, pool.submit(self._load, name)))
+                while pending and self.running:
+                    name, future = pending.popleft()
+                    for next_name in itertools.islice(remaining, 1):
+                        pending.append((next_name, pool.submit(self._load, next_name)))
+                    try:
+                        item = future.result()
+                    except Exception as e:
+                        logging.warning(f"Error reading {name}: {str(e)}")
+                        item = None
+                    if item is None:
+                        self.failed += 1
+                        frames_dropped.inc(source=self.source_id, reason='decode')
+                        continue
+                    yield item
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+class VideoJob(OfflineJob):
+    """A recorded video file, decoded as fast as possible on a dedicated thread.
+
+    Unlike a camera stream nothing is paced to wall-clock time; frames can be
+    sampled every Nth frame or down to a target rate of video time.
+    """
+    type = 'video'
+
+    def __init__(self, controller, source_id, source, model):
+        super().__init__(controller, source_id, source, model)
+        offline = config.get('offline', {})
+        video = offline.get('video', {})
+        self.path = source['connectionDetails']['path']
+        self.capture = cv2.VideoCapture(self.path)
+        if not self.capture.isOpened():
+            raise ValueError(f"Could not open video: {self.path}")
+        self.prefetch = offline.get('prefetch', 64)
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 0.0
+        self.frame_count = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+
+        # Process one frame out of every `step`
+        self.step = max(1, int(video.get('every_n_frames') or 1))
+        target_fps = video.get('target_fps')
+        if target_fps and self.fps > target_fps:
+            self.step = max(self.step, int(round(self.fps / target_fps)))
+        self.decoded = 0
+
+    def describe(self, key):
+        record = {'frame': key}
+        if self.fps:
+            record['time'] = round(key / self.fps, 3)
+        return record
+
+    def progress(self, complete=False):
+        progress = super().progress(complete)
+        # How much faster than real time the video is being analysed
+        elapsed = progress['elapsed']
+        progress['speed'] = round(self.decoded / self.fps / elapsed, 1) if self.fps and elapsed > 0 else 0.0
+        return progress
+
+    def _put(self, queue, item, stopped):
+        """Block while the queue is full, giving up when the job stops"""
+        while self.running and not stopped.is_set():
+            try:
+                queue.put(item, timeout=0.5)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _decode(self, queue, stopped, index):
+        """Decode thread: grab every frame, only retrieve and letterbox the sampled ones"""
+        try:
+            while self.running and not stopped.is_set():
+                if not self.capture.grab():
+                    break
+                self.decoded += 1
+                frame_index = index
+                index += 1
+                if frame_index % self.step:
+                    continue
+
+                started = time.perf_counter()
+                ret, frame = self.capture.retrieve()
+                if not ret:
+                    self.failed += 1
+                    frames_dropped.inc(source=self.source_id, reason='decode')
+                    continue
+                frames_captured.inc(source=self.source_id)
+                stage_seconds.observe(time.perf_counter() - started, source=self.source_id, stage='decode')
+
+                started = time.perf_counter()
+                letterbox = Letterbox()
+                model_input = letterbox(frame)
+                stage_seconds.observe(time.perf_counter() - started, source=self.source_id, stage='preprocess')
+                if not self._put(queue, (frame_index, frame, letterbox, model_input), stopped):
+                    break
+        except Exception as e:
+            logging.error(f"Error decoding video source {self.source_id}: {str(e)}")
+            stream_errors.inc(source=self.source_id, stage='capture')
+        finally:
+            self.capture.release()
+            self._put(queue, None, stopped)
+
+    def items(self):
+        index = 0
+        last = self.checkpoint.get('last') if self.checkpoint else None
+        if last is not None:
+            index = last + 1
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+        first = -(-index // self.step) * self.step  # First sampled frame at or after index
+        self.total = self.processed + len(range(first, self.frame_count, self.step))
+
+        queue = Queue(maxsize=self.prefetch)
+        stopped = threading.Event()
+        decoder = threading.Thread(target=self._decode, args=(queue, stopped, index))
+        decoder.daemon = True
+        decoder.start()
+        try:
+            while self.running:
+                try:
+                    item = queue.get(timeout=0.5)
+                except Empty:
+                    continue
+                if item is None:
+                    break
+                yield item
+        finally:
+            stopped.set()
+            decoder.join(timeout=2)
+
+# Source type -> job that processes it
+JOBS = {job.type: job for job in (DirectoryJob, VideoJob)}
@@ -0,0 +1,187 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from app_utils.config import config
+from app_utils.metrics import batch_seconds, batch_size, queue_depth
+
+class InferenceScheduler:
+    """Collects frames from all running streams and runs them through the model as one batch.
+
+    Live streams come first. Background frames (offline jobs, which the compute budget
+    doesn't cover) only fill the room live frames leave in a batch, or run on their own
+    once no live stream is waiting, and their batches don't count towards frame_seconds.
+    """
+
+    def __init__(self, model, max_batch_size=None, max_wait_ms=None, name='default'):
+        # model is an InferenceEngine: list of letterboxed frames in, list of Nx6 arrays out
+        batching = config['yolo'].get('batching', {})
+        self.model = model
+        self.name = name
+        self.max_batch_size = max_batch_size or batching.get('max_batch_size', 8)
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else batching.get('max_wait_ms', 15)) / 1000.0
+        self.frame_seconds = None  # Moving average of batch time per frame, the cost the compute budget uses
+        self.pending = {}       # source_id -> (frame, future), one entry per stream
+        self.background = {}    # Unique key -> (frame, future), in submission order
+        self.registered = set() # Streams expected to submit frames
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """Start the scheduler thread"""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        logging.info(f"Inference scheduler started (max batch {self.max_batch_size}, max wait {self.max_wait * 1000:.0f} ms)")
+
+    def stop(self):
+        """Stop the scheduler thread and fail any pending requests"""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+        with self.condition:
+            for queue in (self.pending, self.background):
+                for _, future in queue.values():
+                    future.cancel()
+                queue.clear()
+        logging.info("Inference scheduler stopped")
+
+    def register(self, source_id):
+        """Announce a stream that will submit frames"""
+        with self.condition:
+            self.registered.add(source_id)
+
+    def unregister(self, source_id):
+        """Remove a stream and cancel its pending requests, tiles included"""
+        with self.condition:
+            self.registered.discard(source_id)
+            for key in [key for key in self.pending if key == source_id or key.startswith(f"{source_id}:tile")]:
+                self.pending.pop(key)[1].cancel()
+            self.condition.notify_all()
+
+    def submit(self, source_id, frame, background=False):
+        """Queue a frame for the next batch and return a Future resolving to its detections.
+
+        Background frames have unique keys and are all run, after any live frames.
+        """
+        future = Future()
+        with self.condition:
+            queue = self.background if background else self.pending
+            previous = queue.pop(source_id, None)
+            if previous is not None:
+                # Only the latest frame of a stream is worth inferring
+                previous[1].cancel()
+            queue[source_id] = (frame, future)
+            self._update_depth()
+            self.condition.notify_all()
+        return future
+
+    def submit_tiles(self, source_id, tiles):
+        """Queue all the tiles of one frame together and return a Future per tile.
+
+        The first tile stands in for the stream itself, so a batch doesn't wait for it;
+        the tiles land in the same batch as long as they fit in max_batch_size.
+        """
+        futures = []
+        with self.condition:
+            for index, tile in enumerate(tiles):
+                key = source_id if index == 0 else f"{source_id}:tile{index}"
+                previous = self.pending.pop(key, None)
+                if previous is not None:
+                    previous[1].cancel()
+                future = Future()
+                self.pending[key] = (tile, future)
+                futures.append(future)
+            self._update_depth()
+            self.condition.notify_all()
+        return futures
+
+    def _update_depth(self):
+        queue_depth.set(len(self.pending) + len(self.background), model=self.name)
+
+    def _batch_ready(self):
+        """A batch is ready when it is full or every registered stream has submitted.
+
+        While live streams are registered, background frames don't fill a batch on their
+        own: they wait out max_wait for the streams' next frames.
+        """
+        if len(self.pending) >= self.max_batch_size:
+            return True
+        if self.registered:
+            return self.registered.issubset(self.pending.keys())
+        return len(self.pending) + len(self.background) >= self.max_batch_size
+
+    def _take(self, queue, count, live, batch):
+        for key in list(queue.keys())[:count]:
+            frame, future = queue.pop(key)
+            if future.set_running_or_notify_cancel():
+                batch.append((key, frame, future, live))
+
+    def _run(self):
+        while self.running:
+            with self.condition:
+                while self.running and not (self.pending or self.background):
+                    self.condition.wait(0.5)
+                if not self.running:
+                    break
+
+                # Give other streams a chance to join the batch
+                deadline = time.time() + self.max_wait
+                while self.running and not self._batch_ready():
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+
+                # Live frames first, background frames in the room that is left
+                batch = []
+                self._take(self.pending, self.max_batch_size, True, batch)
+                self._take(self.background, self.max_batch_size - len(batch), False, batch)
+                self._update_depth()
+
+            if batch:
+                self._run_batch(batch)
+
+        logging.info("Inference scheduler thread stopped")
+
+    def _run_batch(self, batch):
+        """Hand the batch to the model and give each result back to its stream when it completes.
+
+        In-process engines finish before submit returns. A worker pool only blocks while all
+        its workers are busy, so several batches can be in flight at once.
+        """
+        frames = [frame for _, frame, _, _ in batch]
+        started = time.perf_counter()
+        try:
+            result = self.model.submit(frames)
+        except Exception as e:
+            self._fail(batch, e)
+            return
+        result.add_done_callback(lambda done: self._finish_batch(batch, done, started))
+
+    def _finish_batch(self, batch, done, started):
+        try:
+            detections = done.result()
+        except Exception as e:
+            self._fail(batch, e)
+            return
+        elapsed = time.perf_counter() - started
+        batch_seconds.observe(elapsed, model=self.name)
+        batch_size.observe(len(batch), model=self.name)
+        # Only batches with live frames measure the cost the compute budget hands out
+        if any(live for _, _, _, live in batch):
+            per_frame = elapsed / len(batch)
+            self.frame_seconds = per_frame if self.frame_seconds is None else 0.9 * self.frame_seconds + 0.1 * per_frame
+        for (_, _, future, _), dets in zip(batch, detections):
+            future.set_result(dets)
+
+    def _fail(self, batch, error):
+        logging.error(f"Error running batch of {len(batch)} frames: {str(error)}")
+        for _, _, future, _ in batch:
+            future.set_exception(error)
@@ -1,56 +1,152 @@
 import cv2
-import base64
+import functools
 import logging
+import numpy as np
 import threading
 import time
-from threading import Lock
+from collections import deque
+from concurrent.futures import CancelledError, wait
+from datetime import datetime
+from app_models.detection import Detection, DetectionWriter
 from app_models.source import Source
+from app_utils.config import config, source_settings
+from app_utils.encoding import ENCODING_DEFAULTS, JpegEncoder, check_encoding
+from app_utils.metrics import (frame_age_seconds, frames_dropped, frames_processed,
+                               inference_skipped, inference_tracked, stage_seconds, stream_errors, viewers as viewers_gauge)
+from app_utils.motion import MOTION_DEFAULTS, MotionGate
+from app_utils.preprocess import Letterbox, DisplayResizer
+from app_utils.tiling import TILING_DEFAULTS, Tiler
+from app_utils.tracking import TRACKING_DEFAULTS, Tracker
+from controllers._model import ModelRegistry
+from controllers.admission import ADMISSION_DEFAULTS, ComputeBudget
+from controllers.capture import CaptureManager
+from controllers.flow import ClientFlow
+from controllers.offline import JOBS
 
 class StreamController:
-    def __init__(self, socketio, model, labels, device):
+    def __init__(self, socketio, model, labels, device, model_name='default', registry=None):
         # Keep existing initialization
         self.socketio = socketio
         self.model = model
         self.labels = labels
         self.device = device
         self.streams = {}  # Store all stream-related data
-        self.locks = {}    # Thread synchronization locks
-        logging.info(f"StreamController initialized with model on {device}")
+        self.viewers = {}  # source_id -> {sid: ClientFlow} for the clients watching it
+        self.viewers_lock = threading.Lock()
+        self.start_locks = {}  # source_id -> lock, so a source can't be started twice at once
 
-    def start_stream(self, source_id, frame_rate=10):  # Add frame_rate parameter
-        """Start streaming from a camera source"""
+        # One connection and decoder per camera, shared by every stream that uses it
+        self.captures = CaptureManager()
+
+        # Inference time is shared between live streams; those that don't fit are turned away
+        self.budget = ComputeBudget()
+        self.rejections = {}  # source_id -> why its last start was refused
+
+        # Models are loaded on demand; the one given here is the default for new streams
+        self.registry = registry or ModelRegistry()
+        self.default_model = model_name
+        if model is not None and model_name not in self.registry.models:
+            self.registry.add(model_name, model, labels, None)
+
+        # Detection history is written in batches off the processing threads
+        self.detection_writer = None
+        if config.get('detections', {}).get('enabled', True):
+            self.detection_writer = DetectionWriter()
+            self.detection_writer.start()
+
+        # JPEG encoding runs on a pool shared by all streams, off the processing threads
+        self.encoder = JpegEncoder()
+        logging.info(f"StreamController initialized with model {model_name} on {device}")
+
+    def start_stream(self, source_id, frame_rate=10, model_name=None):  # Add frame_rate parameter
+        """Start streaming from a camera source, or processing a directory or video source"""
+        # setdefault is atomic; a second startStream for the source waits and finds it running
+        with self.start_locks.setdefault(source_id, threading.Lock()):
+            return self._start_stream(source_id, frame_rate, model_name)
+
+    def _start_stream(self, source_id, frame_rate, model_name):
+        model = None
         try:
+            if source_id in self.streams:
+                logging.info(f"Stream for source {source_id} already running")
+                return True
+
             logging.info(f"Starting stream for source {source_id} at {frame_rate} FPS")
             
             # Get source configuration
             source = Source.get_by_id(source_id)
-            if not source or source['type'] != 'camera':
+            if not source or (source['type'] != 'camera' and source['type'] not in JOBS):
                 logging.error(f"Invalid source: {source_id}")
                 return False
 
+            # Load (or reuse) the model before touching the camera
+            model = self.registry.acquire(model_name or self.default_model)
+
+            # Per-source JPEG quality, chroma subsampling and display size
+            encoding = check_encoding(source_settings('encoding', source, ENCODING_DEFAULTS))
+
+            if source['type'] in JOBS:
+                return self._start_job(source_id, source, model, frame_rate, encoding)
+
             # Setup RTSP connection
             rtsp_url = f"rtsp://{source['connectionDetails']['user']}:{source['connectionDetails']['password']}@{source['connectionDetails']['address']}/axis-media/media.amp"
             logging.info(f"Connecting to RTSP URL: {rtsp_url}")
             
-            capture = cv2.VideoCapture(rtsp_url)
-            if not capture.isOpened():
-                logging.error("Failed to open RTSP stream")
+            # Reuses the camera's connection if another stream already has it open
+            capture = self.captures.acquire(rtsp_url, source_id)
+            if capture is None:
+                self.registry.release(model['name'])
                 return False
+
+            # Tiles per frame at the camera's resolution. They must all fit in one batch
+            # (checked again on the first frame if the camera doesn't report its resolution),
+            # and each one is an inference the budget has to pay for
+            tiling = source_settings('tiling', source, TILING_DEFAULTS)
+            tiles = 1
+            if tiling['enabled'] and capture.frame_size:
+                width, height = capture.frame_size
+                try:
+                    tiles = Tiler(tiling['tile_size'], tiling['overlap'], tiling['full_frame'],
+                                  max_tiles=model['scheduler'].max_batch_size).check(height, width)
+                except ValueError as e:
+                    logging.error(f"Stream for source {source_id} not started: {str(e)}")
+                    self.rejections[source_id] = str(e)
+                    self.captures.release(capture)
+                    self.registry.release(model['name'])
+                    return False
+
+            # Reserve a share of the compute budget
+            tracking = source_settings('tracking', source, TRACKING_DEFAULTS)
+            granted, changed = self.budget.admit(source_id, frame_rate, model['scheduler'],
+                                                 self._inference_frames(tracking, tiles),
+                                                 source_settings('admission', source, ADMISSION_DEFAULTS))
+            if granted is None:
+                logging.warning(f"Stream for source {source_id} rejected: {changed}")
+                self.rejections[source_id] = changed
+                self.captures.release(capture)
+                self.registry.release(model['name'])
+                return False
+            if granted < frame_rate:
+                logging.info(f"Stream for source {source_id} granted {granted:.1f} of {frame_rate} FPS")
             
             # Initialize stream data with client-specified frame rate
-            self.locks[source_id] = Lock()
             self.streams[source_id] = {
-                'capture': capture,
+                'capture': capture,        # SharedCapture, released when the stream stops
                 'frame_rate': frame_rate,  # Use client-specified frame rate
-                'latest_frame': None,
+                'frames': capture.frames,  # Capture -> processing hand-off, decoded into in place
+                'model': model,            # Registry entry: engine, labels and scheduler
+                'encoding': encoding,
+                'motion': source_settings('motion', source, MOTION_DEFAULTS),
+                'tracking': tracking,
+                'tiling': tiling,
                 'running': True,
-                'last_processed': 0
+                'dropped': 0
             }
+            model['scheduler'].register(source_id)
 
-            # Start capture thread
-            self._start_capture_thread(source_id)
             # Start processing thread
             self._start_processing_thread(source_id)
+            self._emit_budget(changed)
 
             logging.info(f"Stream started successfully for source {source_id}")
             return True
@@ -58,46 +154,276 @@ class StreamController:
         except Exception as e:
             logging.error(f"Error starting stream: {str(e)}")
             logging.exception("Full traceback:")
+            if model is not None and source_id not in self.streams:
+                self.registry.release(model['name'])
+                self._emit_budget(self.budget.release(source_id))
             return False
 
+    def _start_job(self, source_id, source, model, frame_rate, encoding):
+        """Run a recorded source through the model as fast as possible"""
+        job = JOBS[source['type']](self, source_id, source, model)
+        self.streams[source_id] = {
+            'job': job,
+            'frame_rate': frame_rate,  # Only paces the preview frames sent to viewers
+            'model': model,
+            'encoding': encoding,
+            'running': True
+        }
+        job.start()
+        return True
+
+    @staticmethod
+    def _inference_frames(tracking, tiles=1):
+        """Frames the model runs per processed frame, the unit of a stream's compute cost"""
+        if tracking['enabled']:
+            return tiles / max(1, int(tracking['detect_every']))
+        return tiles
+
+    def rejection(self, source_id):
+        """Why the last start of a source was refused by the compute budget, if it was"""
+        return self.rejections.pop(source_id, None)
+
+    def _emit_budget(self, changed):
+        """Tell the viewers of every stream whose rate changed what it now gets"""
+        for source_id in changed:
+            stats = self.budget.stats(source_id)
+            if stats is not None:
+                self.socketio.emit('streamBudget', stats, to=self.room(source_id))
+
+    def _job_finished(self, source_id, job):
+        """Called by a job's thread when it ends, whether it completed or was stopped"""
+        stream = self.streams.get(source_id)
+        if stream is not None and stream.get('job') is job:
+            del self.streams[source_id]
+            self.registry.release(stream['model']['name'])
+            logging.info(f"Job finished and resources cleaned up for source {source_id}")
+
+    def is_job(self, source_id):
+        """Whether a source is being processed as a job rather than streamed live"""
+        stream = self.streams.get(source_id)
+        return stream is not None and 'job' in stream
+
+    def set_model(self, source_id, model_name):
+        """Switch a running stream to another model without touching its capture"""
+        try:
+            stream = self.streams.get(source_id)
+            if stream is None:
+                logging.error(f"No running stream for source {source_id}")
+                return False
+            if 'job' in stream:
+                # Results of one job should all come from the same model
+                logging.error(f"Cannot switch the model of a running job for source {source_id}")
+                return False
+
+            old_model = stream['model']
+            if old_model['name'] == model_name:
+                return True
+
+            new_model = self.registry.acquire(model_name)
+            new_model['scheduler'].register(source_id)
+            stream['model'] = new_model
+            self._emit_budget(self.budget.update(source_id, scheduler=new_model['scheduler']))
+            # Any frame still queued for the old model is dropped, the next one uses the new model
+            old_model['scheduler'].unregister(source_id)
+            self.registry.release(old_model['name'])
+
+            logging.info(f"Source {source_id} switched from model {old_model['name']} to {model_name}")
+            return True
+        except Exception as e:
+            logging.error(f"Error switching model for source {source_id}: {str(e)}")
+            logging.exception("Full traceback:")
+            return False
+
+    def stream_model(self, source_id):
+        """Name of the model a running stream uses"""
+        stream = self.streams.get(source_id)
+        return stream['model']['name'] if stream else None
+
+    def encoding(self, source_id):
+        """JPEG settings of a running stream, or the configured defaults"""
+        stream = self.streams.get(source_id)
+        return stream['encoding'] if stream else check_encoding(source_settings('encoding', None, ENCODING_DEFAULTS))
+
+    @staticmethod
+    def room(source_id):
+        """Socket.IO room holding the clients subscribed to a source"""
+        return f"stream:{source_id}"
+
+    def add_viewer(self, source_id, sid, frame_rate, mode='overlay'):
+        """Register a client as watching a source at the frame rate and in the mode it asked for"""
+        flow = ClientFlow(sid, frame_rate, mode, self.encoding(source_id)['quality'])
+        with self.viewers_lock:
+            self.viewers.setdefault(source_id, {})[sid] = flow
+            viewers_gauge.set(len(self.viewers[source_id]), source=source_id)
+
+    def remove_viewer(self, source_id, sid):
+        """Unregister a client from a source, returning the number of viewers left"""
+        with self.viewers_lock:
+            viewers = self.viewers.get(source_id, {})
+            viewers.pop(sid, None)
+            if not viewers:
+                self.viewers.pop(source_id, None)
+            viewers_gauge.set(len(viewers), source=source_id)
+            return len(viewers)
+
+    def remove_client(self, sid):
+        """Unregister a disconnected client, returning the sources that have no viewers left"""
+        orphaned = []
+        with self.viewers_lock:
+            for source_id in list(self.viewers.keys()):
+                viewers = self.viewers[source_id]
+                if sid in viewers:
+                    del viewers[sid]
+                    viewers_gauge.set(len(viewers), source=source_id)
+                    if not viewers:
+                        del self.viewers[source_id]
+                        orphaned.append(source_id)
+        return orphaned
+
+    def _flows(self, source_id):
+        """Snapshot of the flow controllers of a source's viewers"""
+        with self.viewers_lock:
+            return list(self.viewers.get(source_id, {}).values())
+
+    def _processing_rate(self, source_id, default_rate):
+        """Process as fast as the fastest viewer currently consumes, never faster than requested
+        or than the stream's share of the compute budget"""
+        flows = self._flows(source_id)
+        rate = default_rate
+        if flows:
+            now = time.time()
+            rate = max(flow.effective_fps(now) for flow in flows)
+        granted = self.budget.rate(source_id)
+        return min(rate, granted) if granted else rate
+
+    def _ready_flows(self, source_id, mode, now):
+        """Viewers in a mode that can take the next frame, counting those that have to skip it"""
+        ready = []
+        for flow in self._flows(source_id):
+            if flow.mode != mode:
+                continue
+            dropped = flow.dropped
+            if flow.ready(now):
+                ready.append(flow)
+            elif flow.dropped > dropped:
+                frames_dropped.inc(source=source_id, reason='backpressure')
+        return ready
+
+    def _emit_frame(self, source_id, frame, flows=None):
+        """Send a drawn frame to every overlay viewer that is ready for one.
+
+        The frame is encoded on the encoder pool once per quality level, however many
+        viewers share it, and sent when the encode finishes. Returns the encode futures;
+        the frame must not be changed until they are done.
+        """
+        now = time.time()
+        if flows is None:
+            flows = self._ready_flows(source_id, 'overlay', now)
+        subsampling = self.encoding(source_id)['subsampling']
+        encodes = {}
+        for flow in flows:
+            quality = flow.quality
+            if quality not in encodes:
+                encodes[quality] = self.encoder.submit(frame, quality, subsampling, source_id)
+            flow.on_sent(now)
+            encodes[quality].add_done_callback(functools.partial(self._send_frame, source_id, flow))
+        return list(encodes.values())
+
+    def _send_frame(self, source_id, flow, encode):
+        """Encode callback: emit the JPEG to one viewer"""
+        try:
+            image = encode.result()
+        except Exception as e:
+            logging.error(f"Error encoding frame for source {source_id}: {str(e)}")
+            stream_errors.inc(source=source_id, stage='encode')
+            flow.abandon()
+            return
+        started = time.perf_counter()
+        self.socketio.emit('frame', {
+            'sourceId': source_id,
+            'image': image
+        }, to=flow.sid, callback=flow.ack)
+        stage_seconds.observe(time.perf_counter() - started, source=source_id, stage='emit')
+
+    def _emit_detections(self, source_id, flows, frame, boxes, captured_at, labels):
+        """Send boxes for the browser to draw, with a small undrawn keyframe every keyframe_interval.
+
+        Coordinates are in the display frame's pixels; width and height let the client
+        scale them onto whatever keyframe it is showing.
+        """
+        now = time.time()
+        if boxes is None or len(boxes) == 0:
+            boxes = np.zeros((0, 6), dtype=np.float32)
+        height, width = frame.shape[:2]
+        payload = {
+            'sourceId': source_id,
+            'timestamp': captured_at,
+            'width': width,
+            'height': height,
+            'boxes': np.rint(boxes[:, :4]).astype(int).tolist(),
+            'classes': boxes[:, 5].astype(int).tolist(),
+            'scores': np.round(boxes[:, 4].astype(float), 2).tolist()
+        }
+        if boxes.shape[1] > 6:
+            payload['ids'] = boxes[:, 6].astype(int).tolist()
+        keyframes = {}
+        small = None
+        for flow in flows:
+            message = payload
+            if flow.keyframe_due(now):
+                quality = flow.quality
+                if quality not in keyframes:
+                    # Keyframes are small and seconds apart, encoded right here
+                    if small is None:
+                        scale = config.get('streaming', {}).get('keyframe_scale', 0.5)
+                        small = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else frame
+                    keyframes[quality] = self.encoder.encode(small, quality, self.encoding(source_id)['subsampling'], source_id)
+                message = {**payload, 'image': keyframes[quality], 'labels': labels}
+            flow.on_sent(now)
+            self.socketio.emit('detections', message, to=flow.sid, callback=flow.ack)
+
+    def _emit_stats(self, source_id):
+        """Tell each viewer which rate and quality it is actually getting"""
+        granted = self.budget.rate(source_id)
+        for flow in self._flows(source_id):
+            stats = flow.stats(source_id)
+            stats['grantedFps'] = granted
+            self.socketio.emit('streamStats', stats, to=flow.sid)
+
     def cleanup(self):
         """Stop all active streams and clean up resources"""
         logging.info("Cleaning up all streams")
         try:
             # Get list of active streams first to avoid modification during iteration
-            active_streams = list(self.active_streams.keys())
+            active_streams = list(self.streams.keys())
             for source_id in active_streams:
                 self.stop_stream(source_id)
+            self.registry.stop()
+            self.captures.stop()
+            self.encoder.stop()
+            if self.detection_writer is not None:
+                self.detection_writer.stop()
         except Exception as e:
             logging.error(f"Error during cleanup: {str(e)}")
         
     def stop_stream(self, source_id):
         try:
             logging.info(f"Stopping stream for source {source_id}")
-            if source_id in self.active_streams:
-                # First set processing to false to stop the threads
-                self.active_streams[source_id]['processing'] = False
+            if self.is_job(source_id):
+                # The job stores the batches it already submitted, then cleans up after itself
+                self.streams[source_id]['running'] = False
+                self.streams[source_id]['job'].stop()
+                return True
+            stream = self.streams.get(source_id)
+            if stream is not None:
+                # First set running to false to stop the processing thread
+                stream['running'] = False
+                stream['model']['scheduler'].unregister(source_id)
                 
                 # Give threads time to stop
                 time.sleep(0.5)
                 
-                # Clean up resources in order
-                if source_id in self.captures:
-                    try:
-                        self.captures[source_id]['capture'].release()
-                    except Exception as e:
-                        logging.error(f"Error releasing capture: {str(e)}")
-                    del self.captures[source_id]
-                    
-                if source_id in self.latest_frames:
-                    del self.latest_frames[source_id]
-                    
-                if source_id in self.frame_locks:
-                    del self.frame_locks[source_id]
-                    
-                if source_id in self.active_streams:
-                    del self.active_streams[source_id]
-                    
+                self._release_stream(source_id, stream)
                 logging.info(f"Stream stopped and resources cleaned up for source {source_id}")
                 return True
             return False
@@ -106,66 +432,198 @@ class StreamController:
             logging.exception("Full traceback:")
             return False
         
-    def _start_capture_thread(self, source_id):
-        """Thread for continuous frame capture from camera"""
-        def capture_frames():
-            while self.streams[source_id]['running']:
-                try:
-                    ret, frame = self.streams[source_id]['capture'].read()
-                    if ret:
-                        with self.locks[source_id]:
-                            self.streams[source_id]['latest_frame'] = frame
-                    else:
-                        logging.error(f"Failed to read frame from source {source_id}")
-                        break
-                except Exception as e:
-                    logging.error(f"Error capturing frame: {str(e)}")
-                    break
-            logging.info(f"Capture thread stopped for source {source_id}")
+    def _release_stream(self, source_id, stream):
+        """Free a live stream's capture, model and budget share; only the first caller does"""
+        with self.start_locks.setdefault(source_id, threading.Lock()):
+            if self.streams.get(source_id) is not stream:
+                return False
+            del self.streams[source_id]
 
-        thread = threading.Thread(target=capture_frames)
-        thread.daemon = True
-        thread.start()
-        logging.info(f"Capture thread started for source {source_id}")
+        # The camera connection closes once no other stream uses it
+        self.captures.release(stream['capture'])
+        self.registry.release(stream['model']['name'])
+        self._emit_budget(self.budget.release(source_id))
+        frame_age_seconds.remove(source=source_id)
+        return True
 
     def _start_processing_thread(self, source_id):
         """Thread for processing frames and sending to client"""
+        stream = self.streams[source_id]
+        skip_stale = config['rtsp'].get('skip_stale_frames', True)
+        max_frame_age = config['rtsp'].get('max_frame_age_ms', 500) / 1000.0
+        stats_interval = config.get('streaming', {}).get('stats_interval', 1.0)
+
         def process_frames():
-            while self.streams[source_id]['running']:
+            # Reusable per-stream buffers for the model input and the displayed frame.
+            # With tiling, the model sees overlapping tiles of the frame as one batch.
+            tiling = stream['tiling']
+            tiler = None
+            if tiling['enabled']:
+                tiler = Tiler(tiling['tile_size'], tiling['overlap'], tiling['full_frame'],
+                              max_tiles=stream['model']['scheduler'].max_batch_size)
+            letterbox = tiler if tiler is not None else Letterbox()
+            encoding = stream['encoding']
+            # Two display buffers: one can be encoding while the next frame is resized into the other
+            display = DisplayResizer((encoding['width'], encoding['height']), buffers=2)
+            encodes = deque()  # Encode futures of the frames in the display buffers, oldest first
+            # Static scenes reuse the last detections instead of running the model again
+            motion = stream['motion']
+            gate = None
+            if motion['enabled']:
+                gate = MotionGate(motion['threshold'], motion['min_area'], motion['refresh_interval'], motion['width'])
+            # Optionally run the model every few frames only, tracking the boxes in between
+            tracking = stream['tracking']
+            tracker = None
+            if tracking['enabled']:
+                tracker = Tracker(tracking['iou_threshold'], tracking['max_missed'], tracking['smoothing'])
+            detect_every = max(1, int(tracking['detect_every']))
+            detect_interval = (tracking['detect_interval_ms'] or 0) / 1000.0
+            since_detection = 0  # Frames processed since the model last ran
+            last_detection = 0.0
+            last_result = None  # (model name, detections, labels) of the last inference
+            last_sequence = 0
+            next_due = time.time()
+            next_stats = next_due + stats_interval
+            while stream['running']:
                 try:
+                    # Sleep until the next pacing deadline instead of polling
+                    delay = next_due - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+
+                    # Wait for a frame newer than the last one we processed
+                    latest = stream['frames'].wait(last_sequence, timeout=1.0)
+                    if latest is None:
+                        if stream['frames'].closed:
+                            break
+                        continue
+                    last_sequence, frame, captured_at = latest
+                    if not stream['running']:
+                        # Stopped while waiting; the capture may live on for other streams
+                        stream['frames'].release(frame)
+                        break
+
                     now = time.time()
-                    frame_interval = 1.0 / self.streams[source_id]['frame_rate']
-                    
-                    # Check if it's time to process a new frame
-                    if now - self.streams[source_id]['last_processed'] >= frame_interval:
-                        with self.locks[source_id]:
-                            if self.streams[source_id]['latest_frame'] is not None:
-                                frame = self.streams[source_id]['latest_frame'].copy()
-                                
-                                # Run inference
-                                if self.model is not None:
-                                    results = self.model(frame)
-                                    
-                                    # Draw detections
-                                    for det in results.xyxy[0]:
-                                        if len(det) >= 6:
-                                            x1, y1, x2, y2, conf, cls_id = map(float, det[:6])
-                                            if cls_id < len(self.labels):
-                                                label = f"{self.labels[int(cls_id)]} {conf:.2f}"
-                                                self._draw_detection(frame, int(x1), int(y1), int(x2), int(y2), label)
-                                
-                                # Encode and send frame
-                                _, buffer = cv2.imencode('.jpg', frame)
-                                frame_data = base64.b64encode(buffer).decode('utf-8')
-                                self.socketio.emit('frame', frame_data)
-                                self.streams[source_id]['last_processed'] = now
-                
-                    time.sleep(0.001)  # Small delay to prevent CPU overload
+                    frame_age_seconds.set(now - captured_at, source=source_id)
+                    if skip_stale and now - captured_at > max_frame_age:
+                        # Capture has stalled; don't show an old frame as if it were live
+                        stream['frames'].release(frame)
+                        stream['dropped'] += 1
+                        frames_dropped.inc(source=source_id, reason='stale')
+                        continue
+
+                    # The model input and the displayed frame are resized copies, so the
+                    # ring slot can go back to the capture thread straight away
+                    started = time.perf_counter()
+                    if len(encodes) == len(display.buffers):
+                        # The buffer about to be reused must not be encoding any more
+                        wait(encodes.popleft())
+                    display_frame, display_scale = display(frame)
+                    frame_encodes = []
+                    encodes.append(frame_encodes)
+
+                    # The gate compares the display frame, which is already downscaled
+                    model = stream['model']
+                    due = (tracker is None or since_detection + 1 >= detect_every
+                           or (detect_interval and now - last_detection >= detect_interval))
+                    run_model = (last_result is None or last_result[0] != model['name']
+                                 or (due and (gate is None or gate(display_frame, now))))
+                    if run_model:
+                        model_input = letterbox(frame)
+                    stream['frames'].release(frame)
+                    stage_seconds.observe(time.perf_counter() - started, source=source_id, stage='preprocess')
+
+                    if run_model:
+                        started = time.perf_counter()
+                        if tiler is not None:
+                            tiles = model['scheduler'].submit_tiles(source_id, model_input)
+                            detections = [tile.result() for tile in tiles]
+                        else:
+                            detections = model['scheduler'].submit(source_id, model_input).result()
+                        labels = model['labels']
+                        if tracker is not None and last_result is not None and last_result[0] != model['name']:
+                            # Class ids of another model mean something else, start the tracks over
+                            tracker = Tracker(tracking['iou_threshold'], tracking['max_missed'], tracking['smoothing'])
+                        last_result = (model['name'], detections, labels)
+                        since_detection = 0
+                        last_detection = now
+                        stage_seconds.observe(time.perf_counter() - started, source=source_id, stage='inference')
+
+                        # Only frames the model ran on are stored
+                        if self.detection_writer is not None:
+                            self.detection_writer.add(Detection(source_id, model['name'], letterbox.unmap(detections), labels,
+                                                                timestamp=datetime.utcfromtimestamp(captured_at)))
+                    else:
+                        _, detections, labels = last_result
+                        since_detection += 1
+                        if due:
+                            inference_skipped.inc(source=source_id)
+                        else:
+                            inference_tracked.inc(source=source_id)
+
+                    boxes = letterbox.unmap(detections, display_scale)
+                    if tracker is not None:
+                        # Tracked boxes carry a track id; in between detections they are
+                        # moved along their velocity, unless the scene was found static
+                        if run_model:
+                            boxes = tracker.update(boxes, captured_at)
+                        else:
+                            boxes = tracker.predict(captured_at if not due else None)
+
+                    # Viewers in detections mode draw the boxes themselves, over an undrawn keyframe
+                    send_time = time.time()
+                    compact = self._ready_flows(source_id, 'detections', send_time)
+                    if compact:
+                        self._emit_detections(source_id, compact, display_frame, boxes, captured_at, labels)
+
+                    # Draw and encode at display resolution, not camera resolution, and only
+                    # when an overlay viewer can take the frame
+                    overlay = self._ready_flows(source_id, 'overlay', send_time)
+                    if overlay:
+                        started = time.perf_counter()
+                        if boxes is not None:
+                            for det in boxes:
+                                if len(det) >= 6:
+                                    x1, y1, x2, y2, conf, cls_id = map(float, det[:6])
+                                    if cls_id < len(labels):
+                                        label = f"{labels[int(cls_id)]} {conf:.2f}"
+                                        if len(det) > 6:
+                                            label = f"#{int(det[6])} {label}"
+                                        self._draw_detection(display_frame, int(x1), int(y1), int(x2), int(y2), label)
+                        stage_seconds.observe(time.perf_counter() - started, source=source_id, stage='draw')
+
+                        # Send as a binary payload to the viewers that can take another frame
+                        frame_encodes.extend(self._emit_frame(source_id, display_frame, overlay))
+                    frames_processed.inc(source=source_id)
+                    if now >= next_stats:
+                        # Re-share the budget with the latest measured cost of this stream's inference
+                        frames = self._inference_frames(tracking, len(tiler) if tiler is not None and len(tiler) else 1)
+                        self._emit_budget(self.budget.update(source_id, frames=frames))
+                        self._emit_stats(source_id)
+                        next_stats = now + stats_interval
+
+                    # Keep a steady cadence, but don't try to catch up after a slow frame
+                    next_due = max(next_due + 1.0 / self._processing_rate(source_id, stream['frame_rate']), now)
                     
+                except CancelledError:
+                    # Request dropped because the stream is stopping or switching models
+                    frames_dropped.inc(source=source_id, reason='cancelled')
+                    if gate is not None:
+                        gate.reset()
+                    continue
                 except Exception as e:
                     logging.error(f"Error processing frame: {str(e)}")
+                    logging.exception("Full traceback:")
+                    stream_errors.inc(source=source_id, stage='process')
                     break
-                    
+
+            if stream['running']:
+                # The camera dropped out or processing failed: nobody will stop this stream,
+                # so free it here and let the next start open the camera again
+                stream['running'] = False
+                stream['model']['scheduler'].unregister(source_id)
+                if self._release_stream(source_id, stream):
+                    logging.warning(f"Stream for source {source_id} ended, resources cleaned up")
             logging.info(f"Processing thread stopped for source {source_id}")
 
         thread = threading.Thread(target=process_frames)
@@ -12,11 +12,25 @@ def get_model_info():
             return jsonify({'error': 'No model loaded'}), 404
 
         info = {
+            'name': stream_controller.default_model,
             'device': str(stream_controller.device),
-            'num_classes': len(stream_controller.model.names),
-            'class_names': stream_controller.model.names
+            'num_classes': len(stream_controller.labels),
+            'class_names': stream_controller.labels
         }
         return jsonify(info)
     except Exception as e:
         logging.error(f"Error getting model info: {str(e)}")
         return jsonify({'error': str(e)}), 500
+
+@model_routes.route('/api/models', methods=['GET'])
+def get_models():
+    """List available models and which of them are currently loaded"""
+    try:
+        stream_controller = current_app.stream_controller
+        models = stream_controller.registry.list_models()
+        for model in models:
+            model['default'] = model['name'] == stream_controller.default_model
+        return jsonify(models)
+    except Exception as e:
+        logging.error(f"Error listing models: {str(e)}")
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,91 @@
+from flask import Blueprint, request, jsonify
+from datetime import datetime
+from app_models.db import UnsupportedQuery
+from app_models.detection import Detection
+import logging
+
+detection_routes = Blueprint('detection_routes', __name__)
+
+MAX_LIMIT = 1000
+
+def _parse_time(name):
+    """ISO 8601 query parameter as a naive UTC datetime, or None"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO 8601 time")
+    if parsed.tzinfo is not None:
+        parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+    return parsed
+
+def _filters():
+    """Filters shared by all detection queries"""
+    min_confidence = request.args.get('minConfidence', type=float)
+    return {
+        'source_id': request.args.get('sourceId'),
+        'start': _parse_time('from'),
+        'end': _parse_time('to'),
+        'label': request.args.get('label'),
+        'min_confidence': min_confidence
+    }
+
+def _serialize(document):
+    if '_id' in document:
+        document['_id'] = str(document['_id'])
+    if 'timestamp' in document:
+        document['timestamp'] = document['timestamp'].isoformat() + 'Z'
+    if 'time' in document:
+        document['time'] = document['time'].isoformat() + 'Z'
+    return document
+
+@detection_routes.route('/', methods=['GET'])
+def get_detections():
+    """Frames with matching detections, newest first, paginated with the returned cursor"""
+    try:
+        limit = min(request.args.get('limit', 100, type=int), MAX_LIMIT)
+        documents, cursor = Detection.find(limit=limit, after=request.args.get('after'), **_filters())
+        return jsonify({'detections': [_serialize(document) for document in documents], 'next': cursor})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except UnsupportedQuery as e:
+        # A query the built-in memory backend can't run, such as counts and histograms
+        return jsonify({'error': str(e)}), 501
+    except Exception as e:
+        logging.error(f"Error querying detections: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@detection_routes.route('/counts', methods=['GET'])
+def get_detection_counts():
+    """Detections per label per time bucket (bucket in seconds, default one hour)"""
+    try:
+        bucket_seconds = request.args.get('bucket', 3600, type=float)
+        if bucket_seconds <= 0:
+            raise ValueError("bucket must be a positive number of seconds")
+        buckets = Detection.counts(bucket_seconds=bucket_seconds, **_filters())
+        return jsonify([_serialize(bucket) for bucket in buckets])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except UnsupportedQuery as e:
+        return jsonify({'error': str(e)}), 501
+    except Exception as e:
+        logging.error(f"Error counting detections: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@detection_routes.route('/confidence', methods=['GET'])
+def get_confidence_histogram():
+    """Number of detections per confidence bin"""
+    try:
+        bins = min(max(request.args.get('bins', 10, type=int), 1), 100)
+        filters = _filters()
+        filters.pop('min_confidence')
+        return jsonify(Detection.confidence_histogram(bins=bins, **filters))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except UnsupportedQuery as e:
+        return jsonify({'error': str(e)}), 501
+    except Exception as e:
+        logging.error(f"Error computing confidence histogram: {str(e)}")
+        return jsonify({'error': str(e)}), 500
@@ -14,6 +14,19 @@ def get_sources():
         logging.error(f"Error getting sources: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@source_routes.route('/', methods=['POST'])
+def add_source():
+    try:
+        data = request.json
+        logging.info(f"Adding source: {data.get('name')} ({data.get('type')})")
+        source_id = Source.from_dict(data).save()
+        return jsonify({'message': 'Source added successfully', '_id': source_id}), 201
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error adding source: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @source_routes.route('/<source_id>', methods=['PUT'])  # Changed from '/api/sources/<source_id>'
 def update_source(source_id):
     try:
@@ -3,6 +3,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const sourcesList = document.getElementById('sourcesList');
     const sourceType = document.getElementById('sourceType');
     const cameraFields = document.getElementById('cameraFields');
+    const pathFields = document.getElementById('pathFields');
 
     // Initialize camera fields visibility
     initializeCameraFields();
@@ -33,6 +34,10 @@ document.addEventListener('DOMContentLoaded', function() {
                     user: document.getElementById('cameraUser').value,
                     password: document.getElementById('cameraPassword').value
                 };
+            } else {
+                formData.connectionDetails = {
+                    path: document.getElementById('sourcePath').value
+                };
             }
 
             fetch('/api/sources', {
@@ -59,6 +64,9 @@ document.addEventListener('DOMContentLoaded', function() {
             cameraFields.style.display = sourceType.value === 'camera' ? 'block' : 'none';
             console.log('Camera fields visibility:', sourceType.value === 'camera');
         }
+        if (sourceType && pathFields) {
+            pathFields.style.display = sourceType.value === 'camera' ? 'none' : 'block';
+        }
     }
 
     function loadSources() {
@@ -88,6 +96,10 @@ document.addEventListener('DOMContentLoaded', function() {
                     <p><strong>Address:</strong> ${source.connectionDetails.address}</p>
                     <p><strong>User:</strong> ${source.connectionDetails.user}</p>
                 `;
+            } else if (source.connectionDetails && source.connectionDetails.path) {
+                connectionDetails = `
+                    <p><strong>Path:</strong> ${source.connectionDetails.path}</p>
+                `;
             }
             
             sourceElement.innerHTML = `
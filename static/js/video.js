@@ -4,10 +4,87 @@ document.addEventListener('DOMContentLoaded', function() {
     const socket = io();
     const videoSource = document.getElementById('sourceSelect');
     const frameRate = document.getElementById('frameRate');
+    const modelSelect = document.getElementById('modelSelect');
+    const streamMode = document.getElementById('streamMode');
+    const overlay = document.getElementById('overlay');
     const startButton = document.getElementById('startStream');
     const stopButton = document.getElementById('stopStream');
     const videoFrame = document.getElementById('video');
     let currentStream = null;
+    let currentFrameUrl = null;
+    let keyframe = null;   // Latest undrawn frame in detections mode
+    let labels = [];       // Labels of the stream's model, sent with each keyframe
+
+    const streamStats = document.getElementById('streamStats');
+
+    // Show a JPEG received as a binary payload, releasing the previous frame's object URL.
+    // The server is acked once the frame has been rendered so it can pace itself to us.
+    function showFrame(image, ack) {
+        const url = URL.createObjectURL(new Blob([image], { type: 'image/jpeg' }));
+        videoFrame.onload = videoFrame.onerror = function() {
+            if (ack) {
+                ack();
+            }
+        };
+        videoFrame.src = url;
+        if (currentFrameUrl) {
+            URL.revokeObjectURL(currentFrameUrl);
+        }
+        currentFrameUrl = url;
+    }
+
+    // Detections mode: draw the latest keyframe and the boxes of the newest frame on the canvas.
+    // Box coordinates are in the server's display frame, which may be larger than the keyframe.
+    function showDetections(data) {
+        if (overlay.width !== data.width || overlay.height !== data.height) {
+            overlay.width = data.width;
+            overlay.height = data.height;
+        }
+        const context = overlay.getContext('2d');
+        if (keyframe) {
+            context.drawImage(keyframe, 0, 0, data.width, data.height);
+        } else {
+            context.clearRect(0, 0, data.width, data.height);
+        }
+        context.lineWidth = 2;
+        context.font = '12px sans-serif';
+        data.boxes.forEach((box, i) => {
+            const [x1, y1, x2, y2] = box;
+            let label = `${labels[data.classes[i]] || data.classes[i]} ${data.scores[i].toFixed(2)}`;
+            if (data.ids) {
+                label = `#${data.ids[i]} ${label}`;
+            }
+            context.strokeStyle = 'red';
+            context.strokeRect(x1, y1, x2 - x1, y2 - y1);
+            const textWidth = context.measureText(label).width;
+            context.fillStyle = 'red';
+            context.fillRect(x1, y1 - 18, textWidth + 10, 18);
+            context.fillStyle = 'white';
+            context.fillText(label, x1 + 5, y1 - 5);
+        });
+    }
+
+    function setMode(mode) {
+        videoFrame.style.display = mode === 'detections' ? 'none' : '';
+        overlay.style.display = mode === 'detections' ? '' : 'none';
+    }
+
+    function clearFrame() {
+        videoFrame.onload = videoFrame.onerror = null;
+        videoFrame.src = '';
+        if (keyframe) {
+            keyframe.close();
+            keyframe = null;
+        }
+        overlay.getContext('2d').clearRect(0, 0, overlay.width, overlay.height);
+        if (streamStats) {
+            streamStats.textContent = '';
+        }
+        if (currentFrameUrl) {
+            URL.revokeObjectURL(currentFrameUrl);
+            currentFrameUrl = null;
+        }
+    }
 
     // Function to load sources into dropdown
 	function loadVideoSources() {
@@ -23,10 +100,10 @@ document.addEventListener('DOMContentLoaded', function() {
 				}
 				videoSource.innerHTML = '<option value="">Select a source</option>';
 				sources.forEach(source => {
-					if (source.type === 'camera') {
+					if (['camera', 'directory', 'video'].includes(source.type)) {
 						const option = document.createElement('option');
 						option.value = source._id;
-						option.textContent = source.name;
+						option.textContent = source.type === 'camera' ? source.name : `${source.name} (${source.type})`;
 						videoSource.appendChild(option);
 						console.log('Added source:', source.name);  // Debug log
 					}
@@ -37,18 +114,54 @@ document.addEventListener('DOMContentLoaded', function() {
 			});
 	}
 
-    // Load sources when page loads
+    // Function to load available models into dropdown
+    function loadModels() {
+        fetch('/api/models')
+            .then(response => response.json())
+            .then(models => {
+                if (!modelSelect || models.error) {
+                    return;
+                }
+                modelSelect.innerHTML = '';
+                models.forEach(model => {
+                    const option = document.createElement('option');
+                    option.value = model.name;
+                    option.textContent = model.resident ? `${model.name} (loaded)` : model.name;
+                    option.selected = model.default;
+                    modelSelect.appendChild(option);
+                });
+            })
+            .catch(error => {
+                console.error('Error loading models:', error);
+            });
+    }
+
+    // Load sources and models when page loads
     loadVideoSources();
+    loadModels();
+
+    // Switching models while streaming keeps the camera connection open
+    if (modelSelect) {
+        modelSelect.addEventListener('change', function() {
+            if (currentStream) {
+                console.log('Switching model:', { sourceId: currentStream, model: modelSelect.value });
+                socket.emit('setModel', { sourceId: currentStream, model: modelSelect.value });
+            }
+        });
+    }
 
     startButton.addEventListener('click', function() {
         const sourceId = videoSource.value;
         const fps = parseInt(frameRate.value);
+        const model = modelSelect ? modelSelect.value : undefined;
+        const mode = streamMode ? streamMode.value : 'overlay';
         if (!sourceId) {
             console.error('No source selected');
             return;
         }
-        console.log('Starting stream:', { sourceId, fps });
-        socket.emit('startStream', { sourceId, fps });
+        console.log('Starting stream:', { sourceId, fps, model, mode });
+        setMode(mode);
+        socket.emit('startStream', { sourceId, fps, model, mode });
         currentStream = sourceId;
         startButton.style.display = 'none';
         stopButton.style.display = 'block';
@@ -63,13 +176,112 @@ document.addEventListener('DOMContentLoaded', function() {
             currentStream = null;
             startButton.style.display = 'block';
             stopButton.style.display = 'none';
-            videoFrame.src = '';
+            clearFrame();
+        }
+    });
+
+    socket.on('frame', function(frameData, ack) {
+        if (currentStream && videoFrame && frameData.sourceId === currentStream) {
+            showFrame(frameData.image, ack);
+        } else if (ack) {
+            ack();
+        }
+    });
+
+    socket.on('detections', function(data, ack) {
+        if (!currentStream || data.sourceId !== currentStream) {
+            if (ack) {
+                ack();
+            }
+            return;
+        }
+        if (data.labels) {
+            labels = data.labels;
+        }
+        if (!data.image) {
+            showDetections(data);
+            if (ack) {
+                ack();
+            }
+            return;
+        }
+        createImageBitmap(new Blob([data.image], { type: 'image/jpeg' }))
+            .then(bitmap => {
+                if (keyframe) {
+                    keyframe.close();
+                }
+                keyframe = bitmap;
+            })
+            .catch(error => console.error('Error decoding keyframe:', error))
+            .finally(() => {
+                showDetections(data);
+                if (ack) {
+                    ack();
+                }
+            });
+    });
+
+    socket.on('modelChanged', function(data) {
+        if (currentStream && data.sourceId === currentStream) {
+            if (!data.success) {
+                console.error('Model switch failed, still using:', data.model);
+            }
+            if (modelSelect && data.model) {
+                modelSelect.value = data.model;
+            }
+            loadModels();
+        }
+    });
+
+    socket.on('streamStats', function(stats) {
+        if (currentStream && streamStats && stats.sourceId === currentStream) {
+            const granted = stats.grantedFps && stats.grantedFps < stats.requestedFps ? ` (${stats.grantedFps} granted)` : '';
+            streamStats.textContent = `${stats.achievedFps} of ${stats.requestedFps} FPS${granted}, quality ${stats.quality}, ${stats.dropped} dropped`;
+        }
+    });
+
+    // The server shares inference time between streams and may grant less than was asked for
+    socket.on('streamBudget', function(budget) {
+        if (!currentStream || budget.sourceId !== currentStream) {
+            return;
+        }
+        if (budget.belowMinimum) {
+            console.warn(`Stream gets ${budget.grantedFps} FPS, below its minimum of ${budget.minFps} FPS: the compute budget is overcommitted`);
+        } else if (budget.grantedFps < budget.requestedFps) {
+            console.log(`Stream limited to ${budget.grantedFps} of ${budget.requestedFps} FPS by the compute budget`);
+        }
+    });
+
+    socket.on('streamRejected', function(data) {
+        if (currentStream && data.sourceId === currentStream) {
+            console.error('Stream rejected:', data.reason);
+            currentStream = null;
+            startButton.style.display = 'block';
+            stopButton.style.display = 'none';
+            clearFrame();
+            if (streamStats) {
+                streamStats.textContent = `Not started: ${data.reason}`;
+            }
+        }
+    });
+
+    // Directory and video jobs report progress instead of per-viewer stream stats
+    socket.on('offlineProgress', function(progress) {
+        if (currentStream && streamStats && progress.sourceId === currentStream) {
+            const total = progress.total ? ` of ${progress.total}` : '';
+            const failed = progress.failed ? `, ${progress.failed} failed` : '';
+            const cached = progress.cached ? `, ${progress.cached} from cache` : '';
+            const speed = progress.speed ? ` (${progress.speed}x real time)` : '';
+            streamStats.textContent = `${progress.processed}${total} processed at ${progress.fps}/s${speed}${cached}${failed}`;
+            if (progress.complete) {
+                streamStats.textContent += ', done';
+            }
         }
     });
 
-    socket.on('frame', function(frameData) {
-        if (currentStream && videoFrame) {
-            videoFrame.src = 'data:image/jpeg;base64,' + frameData;
+    socket.on('offlineResults', function(data) {
+        if (currentStream && data.sourceId === currentStream) {
+            console.log(`Received ${data.results.length} results for source ${data.sourceId}`);
         }
     });
 
@@ -84,7 +296,7 @@ document.addEventListener('DOMContentLoaded', function() {
             currentStream = null;
             startButton.style.display = 'block';
             stopButton.style.display = 'none';
-            videoFrame.src = '';
+            clearFrame();
         }
     });
 });